@@ -35,7 +35,7 @@ from django.utils.dateparse import parse_date
 from django.utils.html import format_html
 
 from badge.forms import ImportTalksForm
-from badge.models import Badge, AuthCode, Setting, Vote, Talk, Track, ApiKey, Scope, Day, Message, Post
+from badge.models import Badge, AuthCode, Setting, Vote, Talk, Track, ApiKey, Scope, Day, Message, Post, Broadcast
 from badge.models.app import App
 
 
@@ -126,11 +126,25 @@ class MessageAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('id', 'sender', 'sent')
+    list_display_links = ('id', )
+    fields = ('sender', 'message')
+
+    def has_add_permission(self, request):
+        return True
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ('id', 'sender', 'created_at')
     list_display_links = ('id', )
     fields = ('id', 'sender', 'created_at', 'content')
+    search_fields = ('content', )
 
     def has_add_permission(self, request):
         return False
@@ -138,6 +152,11 @@ class PostAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
 
 @admin.register(Day)
 class DayAdmin(admin.ModelAdmin):
@@ -0,0 +1,142 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from badge.exceptions import ApiException
+from badge.models import Badge, Post, Setting, Tombstone, Vote
+
+
+def badge_row(row):
+    # There is no endpoint serving images by hash, a changed hash tells consumers to
+    # fetch the image again through export/single
+    row['image_hash'] = row.pop('_image')
+    return row
+
+
+def setting_row(row):
+    row['value'] = json.loads(row['value'])
+    return row
+
+
+# name: (queryset, timestamp field, fields of a row, row post-processing, model name in tombstones)
+FEEDS = {
+    'badges': (Badge.objects.all, 'changed_at', ['id', 'name', 'mac', '_image', 'changed_at'], badge_row, 'badge'),
+    'posts': (Post.objects.all, 'created_at', ['id', 'sender_id', 'content', 'created_at'], None, 'post'),
+    'votes': (Vote.objects.all, 'changed_at', ['id', 'badge_id', 'talk_id', 'rating', 'changed_at'], None, 'vote'),
+    'settings': (Setting.objects.all, 'changed_at', ['id', 'badge_id', 'key', 'value', 'changed_at'], setting_row,
+                 'setting'),
+}
+OPTIONAL = ['posts', 'votes', 'settings']
+# Type of the primary keys in the position of each feed
+PK_TYPES = dict({feed: int for feed in FEEDS}, badges=str, deleted=int)
+
+
+def encode(positions):
+    # Not DjangoJSONEncoder, it cuts timestamps to milliseconds
+    positions = {feed: (timestamp.isoformat(), pk) for feed, (timestamp, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(positions).encode('utf8')).decode('ascii')
+
+
+def decode(cursor):
+    """
+    Positions of every feed in ``cursor``, as (timestamp, primary key) of its last row.
+    """
+    if cursor is None:
+        return {}
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8'))
+        positions = {
+            feed: (parse_datetime(timestamp), pk)
+            for feed, (timestamp, pk) in positions.items()
+        }
+    except (binascii.Error, UnicodeError, ValueError, TypeError, AttributeError):
+        raise ApiException('Invalid cursor set!', 400)
+    for feed, (timestamp, pk) in positions.items():
+        if feed not in PK_TYPES or timestamp is None:
+            raise ApiException('Invalid cursor set!', 400)
+        # type() rather than isinstance(), true and false are no primary keys
+        if type(pk) is not PK_TYPES[feed]:
+            raise ApiException('Invalid cursor set!', 400)
+    return positions
+
+
+def after(queryset, field, position):
+    if position is None:
+        return queryset
+    timestamp, pk = position
+    return queryset.filter(Q(**{field + '__gt': timestamp}) | Q(**{field: timestamp, 'pk__gt': pk}))
+
+
+def page(queryset, field, fields, position, limit, horizon):
+    queryset = after(queryset, field, position).filter(**{field + '__lte': horizon})
+    rows = list(queryset.order_by(field, 'pk').values(*fields)[:limit])
+    if len(rows) > 0:
+        position = (rows[-1][field], rows[-1][queryset.model._meta.pk.attname])
+    return rows, position
+
+
+def changes(cursor, feeds, limit):
+    """
+    Up to ``limit`` rows of each of ``feeds`` changed after ``cursor``, the rows deleted since
+    and the cursor to continue from. Rows are ordered by their timestamp and primary key, so
+    following the cursors visits every change once.
+
+    Timestamps are set when a row is saved, not when its transaction commits. A row saved
+    just before another one can therefore show up after the cursor has already passed it.
+    To avoid skipping such rows, the feeds only go up to ``CHANGES_WINDOW`` seconds ago,
+    which has to be longer than any transaction writing these tables.
+
+    Posts removed by ``manage.py compact`` were archived, not deleted, and are not reported.
+    """
+    positions = decode(cursor)
+    horizon = timezone.now() - timedelta(seconds=settings.CHANGES_WINDOW)
+    result = dict(more=False)
+    for feed in feeds:
+        queryset, field, fields, process, _ = FEEDS[feed]
+        rows, positions[feed] = page(queryset(), field, fields, positions.get(feed), limit, horizon)
+        if process is not None:
+            rows = [process(row) for row in rows]
+        result[feed] = rows
+        result['more'] |= len(rows) == limit
+    models = [FEEDS[feed][4] for feed in feeds]
+    result['deleted'], positions['deleted'] = page(
+        Tombstone.objects.filter(model__in=models), 'deleted_at', ['id', 'model', 'object_id', 'deleted_at'],
+        positions.get('deleted'), limit, horizon,
+    )
+    result['more'] |= len(result['deleted']) == limit
+    result['cursor'] = encode({feed: position for feed, position in positions.items() if position is not None})
+    return result
@@ -79,4 +79,5 @@ class RegistrationError(ApiException):
     pass
 
 
-
+class ThrottleError(ApiException):
+    status_code = 429
@@ -0,0 +1,194 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from badge.models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class PostFeed:
+    """
+    Fans new posts out to all post streams of this process.
+
+    A single background thread looks for new posts, either every ``POST_STREAM_INTERVAL``
+    seconds or right after ``post_send`` created one, and keeps the latest of them in a
+    buffer the streams read from. No matter how many walls are connected, there is only
+    one query per check.
+
+    Streams move on by post id, but ids are not necessarily committed in order (MySQL
+    hands them out at insert time). Posts are therefore only picked up once they are
+    ``POST_STREAM_LAG`` seconds old, so a post whose transaction commits after a later
+    one is not skipped, as long as no transaction takes longer than that.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread = None
+        self._subscribers = 0
+        self._posts = deque()
+        # The buffer holds every post with an id greater than _floor
+        self._floor = None
+        self._last = None
+
+    @staticmethod
+    def serialize(post):
+        return dict(
+            id=post.id,
+            sender=dict(
+                id=post.sender.id,
+                name=post.sender.name,
+            ),
+            content=post.content,
+            created_at=post.created_at,
+        )
+
+    @staticmethod
+    def posts():
+        horizon = timezone.now() - timedelta(seconds=settings.POST_STREAM_LAG)
+        return Post.objects.filter(created_at__lte=horizon).select_related('sender')\
+            .only('id', 'content', 'created_at', 'sender__id', 'sender__name')\
+            .order_by('id')
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            latest = Post.objects.aggregate(latest=Max('id'))['latest'] or 0
+            with self._condition:
+                self._floor = self._last = latest
+            self._thread = Thread(target=self.run, name='post-feed', daemon=True)
+            self._thread.start()
+
+    def run(self):
+        pending = False
+        while True:
+            # Look again as soon as posts too young to be picked up are old enough
+            self._wake.wait(settings.POST_STREAM_LAG if pending else settings.POST_STREAM_INTERVAL)
+            self._wake.clear()
+            if self._subscribers == 0:
+                continue
+            try:
+                pending = self.poll()
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                connection.close()
+
+    def poll(self):
+        """
+        Moves new posts into the buffer, returns whether there are posts not old enough yet.
+        """
+        while True:
+            posts = [self.serialize(post) for post in self.posts().filter(id__gt=self._last)[:settings.POST_STREAM_BUFFER]]
+            if len(posts) == 0:
+                return settings.POST_STREAM_LAG > 0 and Post.objects.filter(id__gt=self._last).exists()
+            with self._condition:
+                self._posts.extend(posts)
+                while len(self._posts) > settings.POST_STREAM_BUFFER:
+                    self._floor = self._posts.popleft()['id']
+                self._last = posts[-1]['id']
+                self._condition.notify_all()
+
+    def wake(self):
+        self._wake.set()
+
+    @contextmanager
+    def subscribe(self):
+        with self._lock:
+            self._subscribers += 1
+        # Nobody looked for new posts while there were no subscribers
+        self.wake()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._subscribers -= 1
+
+    def read(self, after, timeout):
+        """
+        Returns the posts with an id greater than ``after``, waiting up to ``timeout``
+        seconds for new ones.
+        """
+        with self._condition:
+            if after >= self._floor:
+                self._condition.wait_for(lambda: self._last > after, timeout)
+                return [post for post in self._posts if post['id'] > after]
+        # Too far behind the buffer, catch up from the database
+        return [self.serialize(post) for post in self.posts().filter(id__gt=after)[:settings.POST_STREAM_BUFFER]]
+
+    def stream(self, after=None):
+        """
+        Server-sent events of all posts after the post with id ``after``, or of posts
+        created from now on. Ends after ``POST_STREAM_TIMEOUT`` seconds, clients
+        reconnect and resume with their ``Last-Event-ID``.
+        """
+        self.start()
+        if after is None:
+            # Not the last buffered post, the buffer is not kept up to date while nobody is subscribed
+            after = Post.objects.aggregate(latest=Max('id'))['latest'] or 0
+        deadline = monotonic() + settings.POST_STREAM_TIMEOUT
+        yield 'retry: {}\n\n'.format(settings.POST_STREAM_RETRY)
+        with self.subscribe():
+            while monotonic() < deadline:
+                posts = self.read(after, min(settings.POST_STREAM_HEARTBEAT, deadline - monotonic()))
+                if len(posts) == 0:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield ''.join(
+                    'id: {}\ndata: {}\n\n'.format(post['id'], json.dumps(post, cls=DjangoJSONEncoder))
+                    for post in posts
+                )
+                after = posts[-1]['id']
+
+
+feed = PostFeed()
+
+
+@receiver(post_save, sender=Post)
+def wake_feed(sender, instance: Post, created, **kwargs):
+    if created:
+        transaction.on_commit(feed.wake)
@@ -0,0 +1,160 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from badge.models import TalkRating
+
+CACHE_KEY = 'leaderboard'
+FIELDS = ('sum', 'count')
+
+
+class Leaderboard:
+    """
+    Ranking of all talks by their Bayesian average rating.
+
+    The ranking is built from the ``TalkRating`` aggregates and kept in the cache for
+    ``LEADERBOARD_TIMEOUT`` seconds, so reading it never has to look at individual votes.
+    The deltas of incoming votes are added up in per talk counters next to it with
+    ``cache.incr``, which unlike reading and writing back the whole ranking does not lose
+    concurrent votes, and merged in when the ranking is read.
+
+    A vote committing while the ranking is being built may be missed or counted twice,
+    but only until the ranking expires and is built again.
+    """
+
+    @staticmethod
+    def rank(entries):
+        total = sum(entry['sum'] for entry in entries.values())
+        count = sum(entry['count'] for entry in entries.values())
+        mean = total / count if count > 0 else 0
+        weight = settings.LEADERBOARD_WEIGHT
+        for entry in entries.values():
+            entry['score'] = (weight * mean + entry['sum']) / (weight + entry['count'])
+        return sorted(entries.values(), key=lambda entry: (-entry['score'], -entry['count'], entry['id']))
+
+    def build(self):
+        entries = {
+            rating['talk_id']: dict(
+                id=rating['talk_id'],
+                agenda_id=rating['talk__agenda_id'],
+                slug=rating['talk__slug'],
+                title=rating['talk__title'],
+                speaker=rating['talk__speaker'],
+                track=rating['talk__track_id'],
+                day=rating['talk__track__day_id'],
+                sum=rating['sum'],
+                count=rating['count'],
+            )
+            for rating in TalkRating.objects.values(
+                'talk_id', 'talk__agenda_id', 'talk__slug', 'talk__title', 'talk__speaker',
+                'talk__track_id', 'talk__track__day_id', 'sum', 'count',
+            )
+        }
+        return dict(
+            # Keeps the counters of an earlier ranking from being merged into this one
+            generation=uuid.uuid4().hex,
+            expires=time.time() + settings.LEADERBOARD_TIMEOUT,
+            entries=entries,
+            ranking=self.rank(entries),
+        )
+
+    def snapshot(self):
+        snapshot = cache.get(CACHE_KEY)
+        if snapshot is None:
+            snapshot = self.build()
+            cache.set(CACHE_KEY, snapshot, settings.LEADERBOARD_TIMEOUT)
+        return snapshot
+
+    @staticmethod
+    def key(snapshot, talk_id, field, sign):
+        # Separate counters for both directions, memcached does not decrement below zero
+        return '{}:{}:{}:{}:{}'.format(CACHE_KEY, snapshot['generation'], talk_id, field, sign)
+
+    @staticmethod
+    def increment(key, value, timeout):
+        cache.add(key, 0, timeout)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # Evicted in between
+            cache.set(key, value, timeout)
+
+    def update(self, deltas):
+        """
+        Adds the deltas returned by ``TalkRating.objects.record`` to the counters of the
+        cached ranking.
+        """
+        snapshot = cache.get(CACHE_KEY)
+        if snapshot is None:
+            return
+        timeout = snapshot['expires'] - time.time()
+        if timeout <= 0:
+            return
+        if any(talk_id not in snapshot['entries'] for talk_id in deltas.keys()):
+            # Unknown talk, let the next build pick it up
+            cache.delete(CACHE_KEY)
+            return
+        for talk_id, delta in deltas.items():
+            for field in FIELDS:
+                if delta[field] > 0:
+                    self.increment(self.key(snapshot, talk_id, field, '+'), delta[field], timeout)
+                elif delta[field] < 0:
+                    self.increment(self.key(snapshot, talk_id, field, '-'), -delta[field], timeout)
+
+    def ranking(self):
+        snapshot = self.snapshot()
+        counters = cache.get_many([
+            self.key(snapshot, talk_id, field, sign)
+            for talk_id in snapshot['entries'].keys()
+            for field in FIELDS
+            for sign in '+-'
+        ])
+        if len(counters) == 0:
+            return snapshot['ranking']
+        entries = {talk_id: dict(entry) for talk_id, entry in snapshot['entries'].items()}
+        for talk_id, entry in entries.items():
+            for field in FIELDS:
+                entry[field] += counters.get(self.key(snapshot, talk_id, field, '+'), 0)
+                entry[field] -= counters.get(self.key(snapshot, talk_id, field, '-'), 0)
+        return self.rank(entries)
+
+    def top(self, limit, day=None, track=None):
+        return [
+            entry
+            for entry in self.ranking()
+            if (day is None or entry['day'] == day) and (track is None or entry['track'] == track)
+        ][:limit]
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,113 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import base64
+from io import BytesIO
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from badge import utils
+from badge.models import BadgeImage
+from badge.render import FRAME_SIZE, encode_all, image_hash, render_all, render_stored
+
+
+def original_render(data):
+    # Badge.render as it was before the render engine, without any caching
+    data_bytes = np.array(bytearray(data), dtype=np.uint8)
+    image = Image.fromarray(np.invert(np.resize(data_bytes, (128, 296))), '1')
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue())
+
+
+def export_render(digests):
+    # render_stored a chunk of badges at a time, like the exports call it
+    return [
+        base64.b64encode(png)
+        for chunk in utils.chunked(digests, settings.EXPORT_CHUNK_SIZE)
+        for png in render_stored(chunk)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Compares the original per-badge Badge.render loop against the bulk render engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('counts', nargs='*', type=int, default=[1000, 10000], metavar='count',
+                            help='Numbers of random images to render')
+
+    def timed(self, function):
+        start = perf_counter()
+        result = function()
+        return result, perf_counter() - start
+
+    def compare(self, original, rendered):
+        for before, after in zip(original, rendered):
+            if Image.open(BytesIO(base64.b64decode(before))).tobytes() != \
+                    Image.open(BytesIO(base64.b64decode(after))).tobytes():
+                raise CommandError('Bulk rendering produced different images')
+
+    def handle(self, *args, **options):
+        if any(count < 1 for count in options['counts']):
+            raise CommandError('Counts must be positive')
+        generator = np.random.RandomState(0)
+        self.stdout.write('Using {} render workers'.format(settings.RENDER_WORKERS))
+        # Start the pool up front, so the first run does not pay for it
+        encode_all([bytes(FRAME_SIZE)] * (settings.RENDER_CHUNK_SIZE + 1))
+        for count in options['counts']:
+            images = [generator.randint(0, 256, FRAME_SIZE, dtype=np.uint8).tobytes() for _ in range(count)]
+            digests = [image_hash(data) for data in images]
+
+            original, original_time = self.timed(lambda: [original_render(data) for data in images])
+            bulk, bulk_time = self.timed(lambda: [base64.b64encode(png) for png in render_all(images)])
+            self.compare(original, bulk)
+
+            # The exports render stored images, the benchmark rows are rolled back afterwards
+            with transaction.atomic():
+                BadgeImage.objects.bulk_create(
+                    [BadgeImage(hash=digest, data=data) for digest, data in zip(digests, images)],
+                )
+                cold, cold_time = self.timed(lambda: export_render(digests))
+                warm, warm_time = self.timed(lambda: export_render(digests))
+                transaction.set_rollback(True)
+            self.compare(original, cold)
+            self.compare(original, warm)
+
+            self.stdout.write(
+                '{} images: original {:.2f}s, bulk {:.2f}s ({:.1f}x), '
+                'stored cold {:.2f}s ({:.1f}x), stored warm {:.2f}s ({:.1f}x)'.format(
+                    count, original_time, bulk_time, original_time / bulk_time,
+                    cold_time, original_time / cold_time, warm_time, original_time / warm_time,
+                )
+            )
@@ -0,0 +1,162 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from badge.models import AuthCode, BadgeImage, Message, Post, Tombstone
+from badge.models.tombstone import archiving
+
+
+def expired_messages(now, retention):
+    return Message.objects.filter(read=True, sent__lt=now - retention)
+
+
+def expired_posts(now, retention):
+    return Post.objects.filter(created_at__lt=now - retention)
+
+
+def expired_authcodes(now, retention):
+    # Retention counts from the end of the lifetime, a code is useless once it expired
+    return AuthCode.objects.filter(
+        Q(long_lived=False, last_used__lt=now - timedelta(seconds=settings.AUTHCODE_LIFETIME) - retention) |
+        Q(long_lived=True, last_used__lt=now - timedelta(seconds=settings.SESSION_LIFETIME) - retention)
+    )
+
+
+def unused_images(now, retention):
+    # Images are stored before the badge referencing them is saved, so keep new ones around
+    return BadgeImage.objects.filter(badges__isnull=True, stored_at__lt=now - retention)
+
+
+def expired_tombstones(now, retention):
+    return Tombstone.objects.filter(deleted_at__lt=now - retention)
+
+
+# name: (rows to remove, fields of a row, whether rows are archived before deleting them)
+TABLES = {
+    'message': (expired_messages, ['id', 'sender_id', 'receiver_id', 'read', 'message', 'sent'], True),
+    'post': (expired_posts, ['id', 'sender_id', 'content', 'created_at'], True),
+    'authcode': (expired_authcodes, ['id', 'badge_id', 'long_lived', 'last_used'], False),
+    'image': (unused_images, ['hash', 'stored_at'], False),
+    'tombstone': (expired_tombstones, ['id', 'model', 'object_id', 'deleted_at'], False),
+}
+
+
+class Command(BaseCommand):
+    help = 'Archives and deletes old messages and posts, and removes expired auth codes, unused images and old ' \
+           'tombstones, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', metavar='table',
+                            help='Tables to compact ({}), all if omitted'.format(', '.join(TABLES.keys())))
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many rows and bytes would be reclaimed')
+        parser.add_argument('--retention', action='append', default=[], metavar='TABLE=SECONDS',
+                            help='Overrides COMPACT_RETENTION for a table')
+        parser.add_argument('--batch-size', type=int, default=settings.COMPACT_BATCH_SIZE)
+        parser.add_argument('--archive', default=settings.ARCHIVE_ROOT,
+                            help='Directory the NDJSON archives are written to')
+
+    def handle(self, *args, **options):
+        retention = dict(settings.COMPACT_RETENTION)
+        for override in options['retention']:
+            try:
+                table, seconds = override.split('=', 1)
+                retention[table] = int(seconds)
+            except ValueError:
+                raise CommandError('Invalid retention {}, expected TABLE=SECONDS'.format(override))
+            if table not in TABLES:
+                raise CommandError('Unknown table {}'.format(table))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive')
+        for table in options['tables']:
+            if table not in TABLES:
+                raise CommandError('Unknown table {}'.format(table))
+        now = timezone.now()
+        for table in options['tables'] or TABLES.keys():
+            rows, fields, archived = TABLES[table]
+            queryset = rows(now, timedelta(seconds=retention.get(table, 0)))
+            if options['dry_run']:
+                count, size = self.measure(queryset, fields)
+            else:
+                count, size = self.compact(
+                    table, queryset, fields, archived, options['batch_size'], options['archive'], now,
+                )
+            self.stdout.write('{}: {} {} rows, {} bytes'.format(
+                table, 'would remove' if options['dry_run'] else 'removed', count, size,
+            ))
+
+    @staticmethod
+    def serialize(row):
+        return json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+    def measure(self, queryset, fields):
+        count = 0
+        size = 0
+        for row in queryset.values(*fields).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            count += 1
+            size += len(self.serialize(row).encode('utf8'))
+        return count, size
+
+    def compact(self, table, queryset, fields, archived, batch_size, archive, now):
+        model = queryset.model
+        count = 0
+        size = 0
+        path = os.path.join(archive, '{}-{}.ndjson'.format(table, now.strftime('%Y%m%d%H%M%S')))
+        if archived:
+            os.makedirs(archive, exist_ok=True)
+        while True:
+            # Short transactions, so writers are never locked out for long on SQLite
+            with transaction.atomic():
+                ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if len(ids) == 0:
+                    break
+                # Selected again inside the transaction, a row might have been referenced since
+                deletable = queryset.filter(pk__in=ids)
+                lines = [self.serialize(row) for row in deletable.values(*fields)]
+                # Compacted rows are no deletions as far as the change feed is concerned
+                with archiving():
+                    _, removed = deletable.delete()
+                # Written last, so a failed delete never leaves rows in the archive. Should the
+                # write fail, the delete is rolled back with the transaction.
+                if archived and len(lines) > 0:
+                    with open(path, 'a', encoding='utf8') as f:
+                        f.writelines(lines)
+            count += removed.get(model._meta.label, 0)
+            size += sum(len(line.encode('utf8')) for line in lines)
+        return count, size
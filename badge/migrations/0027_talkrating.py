@@ -0,0 +1,54 @@
+# Generated by Django 2.1.5 on 2026-10-19 04:28
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+import django.db.models.deletion
+
+
+def aggregate_votes(apps, schema_editor):
+    Talk = apps.get_model('badge', 'Talk')
+    TalkRating = apps.get_model('badge', 'TalkRating')
+    TalkRating.objects.bulk_create([
+        TalkRating(
+            talk_id=talk['id'],
+            sum=talk['sum'] or 0,
+            count=talk['count'],
+            **{
+                'stars_{}'.format(rating): talk['stars_{}'.format(rating)]
+                for rating in range(0, 6)
+            }
+        )
+        for talk in Talk.objects.values('id').annotate(
+            sum=Sum('ratings__rating'),
+            count=Count('ratings'),
+            **{
+                'stars_{}'.format(rating): Count('ratings', filter=Q(ratings__rating=rating))
+                for rating in range(0, 6)
+            }
+        )
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0026_auto_20190311_0453'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TalkRating',
+            fields=[
+                ('talk', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregate', serialize=False, to='badge.Talk')),
+                ('sum', models.PositiveIntegerField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('stars_0', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(aggregate_votes, reverse_code=migrations.RunPython.noop),
+    ]
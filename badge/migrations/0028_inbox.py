@@ -0,0 +1,38 @@
+# Generated by Django 2.1.5 on 2026-10-19 04:32
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def count_unread(apps, schema_editor):
+    Badge = apps.get_model('badge', 'Badge')
+    Inbox = apps.get_model('badge', 'Inbox')
+    Inbox.objects.bulk_create([
+        Inbox(badge_id=badge['id'], unread=badge['unread'])
+        for badge in Badge.objects.values('id').annotate(
+            unread=Count('received_messages', filter=Q(received_messages__read=False)),
+        )
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0027_talkrating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Inbox',
+            fields=[
+                ('badge', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inbox', serialize=False, to='badge.Badge')),
+                ('unread', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_unread, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', 'read', 'sent'], name='badge_messa_receive_54545e_idx'),
+        ),
+    ]
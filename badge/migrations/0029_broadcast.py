@@ -0,0 +1,27 @@
+# Generated by Django 2.1.5 on 2026-10-19 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0028_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender', models.CharField(default='Organisers', max_length=255)),
+                ('message', models.CharField(max_length=255)),
+                ('sent', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='inbox',
+            name='broadcast',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.5 on 2026-10-19 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0029_broadcast'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at', 'id'], name='badge_post_created_ae6a84_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.1.5 on 2026-10-19 04:38
+
+from django.db import migrations, OperationalError
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute('CREATE VIRTUAL TABLE badge_post_fts USING fts5(content)')
+    except OperationalError:
+        # SQLite was built without FTS5, searches fall back to LIKE
+        return
+    schema_editor.execute('INSERT INTO badge_post_fts (rowid, content) SELECT id, content FROM badge_post')
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS badge_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0030_post_created_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, reverse_code=drop_fts),
+    ]
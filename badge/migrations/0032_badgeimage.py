@@ -0,0 +1,56 @@
+# Generated by Django 2.1.5 on 2026-10-19 05:02
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_images(apps, schema_editor):
+    Badge = apps.get_model('badge', 'Badge')
+    BadgeImage = apps.get_model('badge', 'BadgeImage')
+    for badge in Badge.objects.exclude(_image=b'').only('id', '_image').iterator():
+        data = bytes(badge._image)
+        if not data:
+            continue
+        image, _ = BadgeImage.objects.get_or_create(hash=hashlib.sha256(data).hexdigest(), defaults=dict(data=data))
+        Badge.objects.filter(id=badge.id).update(image_ref=image)
+
+
+def restore_images(apps, schema_editor):
+    Badge = apps.get_model('badge', 'Badge')
+    for badge in Badge.objects.filter(image_ref__isnull=False).select_related('image_ref').iterator():
+        Badge.objects.filter(id=badge.id).update(_image=badge.image_ref.data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0031_post_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BadgeImage',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('stored_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='badge',
+            name='image_ref',
+            field=models.ForeignKey(blank=True, db_column='image_hash', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='badges', to='badge.BadgeImage'),
+        ),
+        migrations.RunPython(move_images, reverse_code=restore_images),
+        migrations.RemoveField(
+            model_name='badge',
+            name='_image',
+        ),
+        migrations.RenameField(
+            model_name='badge',
+            old_name='image_ref',
+            new_name='_image',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.1.5 on 2026-10-19 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0032_badgeimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=32)),
+                ('object_id', models.CharField(max_length=64)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='badge',
+            index=models.Index(fields=['changed_at', 'id'], name='badge_badge_changed_1cd8ec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='setting',
+            index=models.Index(fields=['changed_at', 'id'], name='badge_setti_changed_01f937_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['changed_at', 'id'], name='badge_vote_changed_5c8f74_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='badge_tombs_deleted_fff257_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badge', '0033_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='badgeimage',
+            name='png',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -27,15 +27,20 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+from .badgeimage import BadgeImage
 from .badge import Badge
 from .authcode import AuthCode
 from .day import Day
 from .track import Track
 from .talk import Talk
 from .vote import Vote
+from .talkrating import TalkRating
 from .setting import Setting
 from .scope import Scope
 from .apikey import ApiKey
 
+from .broadcast import Broadcast
+from .inbox import Inbox
 from .message import Message
-from .post import Post
\ No newline at end of file
+from .post import Post
+from .tombstone import Tombstone
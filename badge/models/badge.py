@@ -29,13 +29,12 @@
 
 import base64
 import hashlib
-from io import BytesIO
-
-import numpy as np
-from PIL import Image
 
 from django.db import models
 
+from badge import render as renderer
+from badge.models.badgeimage import BadgeImage
+
 # Create your models here.
 
 
@@ -44,10 +43,17 @@ class Badge(models.Model):
     mac = models.CharField(max_length=12)
     name = models.CharField(max_length=255)
     secret = models.CharField(max_length=64)
-    _image = models.BinaryField(db_column='image', blank=True)
+    # The image data lives in its own table, loading a badge only reads the hash
+    _image = models.ForeignKey(BadgeImage, db_column='image_hash', null=True, blank=True,
+                               on_delete=models.PROTECT, related_name='badges')
     registered_at = models.DateTimeField(auto_now_add=True)
     changed_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['changed_at', 'id']),
+        ]
+
     def set_image(self, data):
         if type(data) is list:
             try:
@@ -57,24 +63,35 @@ class Badge(models.Model):
         elif type(data) is str:
             text = base64.b64decode(data)
         elif type(data) is bytes or type(data) is bytearray:
-            text = data.decode('ascii')
+            text = bytes(data)
         else:
             text = b''
-        self._image = text
+        self._image = BadgeImage.objects.store(text) if text else None
 
     def get_image(self):
-        return self._image
+        return bytes(self._image.data) if self._image_id is not None else b''
 
     image = property(get_image, set_image)
 
-    def render(self):
-        if not self._image:
+    @property
+    def image_hash(self):
+        return self._image_id
+
+    def render_png(self):
+        """
+        The image as raw PNG, kept on the image row so unchanged images are only ever
+        encoded once.
+        """
+        if self._image_id is None:
             return b''
-        data_bytes = np.array(bytearray(self._image), dtype=np.uint8)
-        image = Image.fromarray(np.invert(np.resize(data_bytes, (128, 296))), '1')
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        return base64.b64encode(buffer.getvalue())
+        image = self._image
+        if image.png is None:
+            image.png = renderer.encode(image.data)
+            BadgeImage.objects.store_pngs({image.hash: image.png})
+        return bytes(image.png)
+
+    def render(self):
+        return base64.b64encode(self.render_png())
 
     def __str__(self):
         return 'Badge ({}, {})'.format(self.id, self.name)
@@ -0,0 +1,76 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from django.db import connection, models, transaction, IntegrityError
+
+from badge import render as renderer
+
+
+class BadgeImageManager(models.Manager):
+
+    def store(self, data):
+        """
+        Stores image data once per distinct content and returns the row holding it.
+        """
+        data = bytes(data)
+        digest = renderer.image_hash(data)
+        try:
+            return self.get(hash=digest)
+        except self.model.DoesNotExist:
+            try:
+                with transaction.atomic():
+                    return self.create(hash=digest, data=data)
+            except IntegrityError:
+                return self.get(hash=digest)
+
+    def store_pngs(self, pngs):
+        """
+        Keeps the rendered PNGs, by the hash of their image data, on the image rows.
+        """
+        if len(pngs) == 0:
+            return
+        # One statement for all rows, going through update() per row costs as much as encoding
+        quote = connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany('UPDATE {} SET {} = %s WHERE {} = %s'.format(
+                quote(self.model._meta.db_table), quote('png'), quote('hash'),
+            ), [(png, digest) for digest, png in pngs.items()])
+
+
+class BadgeImage(models.Model):
+    # Content addressed, badges reference the sha256 of the image data
+    hash = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    # Rendered once on first export, the data of a row never changes
+    png = models.BinaryField(null=True, blank=True)
+    stored_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BadgeImageManager()
+
+    def __str__(self):
+        return 'BadgeImage({}, {})'.format(self.hash, len(self.data))
@@ -0,0 +1,105 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.db import models
+from django.db.models import F, Subquery
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from badge.models import Badge, Broadcast
+
+
+class InboxManager(models.Manager):
+
+    def ensure(self, badge_id, unread=0):
+        """
+        The inbox of a badge and whether it was created. Badges only get the broadcasts
+        sent after they registered, also when their inbox is created later on.
+        """
+        try:
+            return self.get(badge_id=badge_id), False
+        except self.model.DoesNotExist:
+            seen = Broadcast.objects.filter(
+                sent__lt=Subquery(Badge.objects.filter(id=badge_id).values('registered_at')),
+            ).latest_id()
+            return self.get_or_create(badge_id=badge_id, defaults=dict(unread=unread, broadcast=seen))
+
+    def add(self, badge_id, count):
+        """
+        Changes the unread counter of a badge by ``count`` with a single ``UPDATE``.
+        """
+        if self.filter(badge_id=badge_id).update(unread=F('unread') + count) == 0:
+            _, created = self.ensure(badge_id, max(0, count))
+            if not created:
+                self.filter(badge_id=badge_id).update(unread=F('unread') + count)
+
+    def pending_broadcasts(self, badge):
+        """
+        Broadcasts ``badge`` has not seen yet, oldest first.
+        """
+        inbox, _ = self.ensure(badge.id)
+        return Broadcast.objects.filter(id__gt=inbox.broadcast).order_by('id')
+
+    def claim_broadcast(self, badge):
+        """
+        Moves the broadcast cursor of ``badge`` past the next pending broadcast and
+        returns it. Like ``Message.objects.claim`` the cursor is only moved forward with a
+        conditional ``UPDATE``, so every broadcast is handed out once per badge.
+        """
+        while True:
+            broadcast = self.pending_broadcasts(badge).first()
+            if broadcast is None:
+                return None
+            if self.filter(badge=badge, broadcast__lt=broadcast.id).update(broadcast=broadcast.id) == 1:
+                return broadcast
+            # Somebody else was faster, try the next one
+
+    def acknowledge_broadcast(self, badge, broadcast_id):
+        self.ensure(badge.id)
+        broadcast_id = min(broadcast_id, Broadcast.objects.latest_id())
+        return self.filter(badge=badge, broadcast__lt=broadcast_id).update(broadcast=broadcast_id)
+
+
+class Inbox(models.Model):
+    badge = models.OneToOneField(Badge, primary_key=True, related_name='inbox', on_delete=models.CASCADE)
+    # Denormalised number of unread messages, only ever changed relatively
+    unread = models.IntegerField(default=0)
+    # Id of the last broadcast delivered to the badge
+    broadcast = models.IntegerField(default=0)
+
+    objects = InboxManager()
+
+    def __str__(self):
+        return 'Inbox ({}, {})'.format(self.badge_id, self.unread)
+
+
+@receiver(post_save, sender=Badge)
+def create_inbox(sender, instance: Badge, created, **kwargs):
+    if created:
+        Inbox.objects.ensure(instance.id)
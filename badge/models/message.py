@@ -27,9 +27,50 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 
-from badge.models import Badge
+from badge.models import Badge, Inbox
+
+
+class MessageManager(models.Manager):
+
+    def send(self, sender, receiver, message):
+        with transaction.atomic():
+            message = self.create(sender=sender, receiver=receiver, message=message)
+            Inbox.objects.add(receiver.id, 1)
+        return message
+
+    def acknowledge(self, receiver, ids):
+        with transaction.atomic():
+            acknowledged = self.filter(receiver=receiver, id__in=ids, read=False).update(read=True)
+            if acknowledged > 0:
+                Inbox.objects.add(receiver.id, -acknowledged)
+        return acknowledged
+
+    def claim(self, receiver):
+        """
+        Marks the oldest unread message of ``receiver`` as read and returns it.
+
+        The message is claimed with a conditional ``UPDATE``, so concurrent polls of the
+        same badge never hand out the same message twice.
+        """
+        while True:
+            message_id = self.filter(receiver=receiver, read=False).order_by('sent', 'id')\
+                .values_list('id', flat=True).first()
+            if message_id is None:
+                return None
+            with transaction.atomic():
+                claimed = self.filter(id=message_id, read=False).update(read=True) == 1
+                if claimed:
+                    Inbox.objects.add(receiver.id, -1)
+            if claimed:
+                return self.select_related('sender', 'receiver')\
+                    .only('id', 'read', 'message', 'sent', 'sender__id', 'sender__name', 'receiver__id', 'receiver__name')\
+                    .get(id=message_id)
+            # Somebody else was faster, try the next one
 
 
 class Message(models.Model):
@@ -39,7 +80,19 @@ class Message(models.Model):
     message = models.CharField(max_length=255, blank=True, editable=False)
     sent = models.DateTimeField(auto_now=True, editable=False)
 
+    objects = MessageManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['receiver', 'read', 'sent']),
+        ]
+
     def __str__(self):
         return 'Message({}, {}, {}, {})'.format(self.sender.__str__(), self.receiver.__str__(), self.read, len(self.message))
 
 
+@receiver(post_delete, sender=Message)
+def remove_message(sender, instance: Message, **kwargs):
+    if not instance.read:
+        # Only touch the counter if the inbox is still there
+        Inbox.objects.filter(badge_id=instance.receiver_id).update(unread=F('unread') - 1)
@@ -27,17 +27,76 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-from django.db import models
+from django.db import models, connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 from badge.models import Badge
 
+# SQLite FTS5 index of the post contents, created by migration 0031 if available
+FTS_TABLE = 'badge_post_fts'
+_fts_databases = {}
+
+
+def fts_available():
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_databases:
+        _fts_databases[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_databases[name]
+
+
+class PostQuerySet(models.QuerySet):
+
+    def search(self, query):
+        """
+        Posts containing all words of ``query``, as prefixes. Uses the FTS5 index on SQLite
+        and falls back to ``LIKE`` on other databases.
+        """
+        terms = query.split()
+        if len(terms) == 0:
+            return self.none()
+        if fts_available():
+            match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+            # Not filter(id__in=RawSQL(...)), SQLite reads the doubly parenthesised subquery as a scalar
+            return self.extra(
+                where=['"badge_post"."id" IN (SELECT rowid FROM {} WHERE {} MATCH %s)'.format(FTS_TABLE, FTS_TABLE)],
+                params=[match],
+            )
+        queryset = self
+        for term in terms:
+            queryset = queryset.filter(content__icontains=term)
+        return queryset
+
 
 class Post(models.Model):
     sender = models.ForeignKey(Badge, on_delete=models.CASCADE, related_name='posts')
     content = models.CharField(max_length=255, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now=True, editable=False)
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     def __str__(self):
         return 'Post({}, {}, {})'.format(self.sender.__str__(), self.created_at, len(self.content))
 
 
+@receiver(post_save, sender=Post)
+def index_post(sender, instance: Post, **kwargs):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [instance.id])
+            cursor.execute('INSERT INTO {} (rowid, content) VALUES (%s, %s)'.format(FTS_TABLE),
+                           [instance.id, instance.content])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance: Post, **kwargs):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [instance.id])
@@ -43,6 +43,9 @@ class Setting(models.Model):
 
     class Meta:
         unique_together = (('badge', 'key'), )
+        indexes = [
+            models.Index(fields=['changed_at', 'id']),
+        ]
 
     def __str__(self):
         return 'Settings ({}, {})'.format(self.badge.__str__(), self.key)
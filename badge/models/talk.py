@@ -27,8 +27,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-from statistics import mean
-
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 
 from badge.models.track import Track
@@ -47,5 +46,8 @@ class Talk(models.Model):
 
     @property
     def rating(self):
-        return mean(self.ratings.values_list('rating', flat=True))
+        try:
+            return self.aggregate.mean
+        except ObjectDoesNotExist:
+            return 0
 
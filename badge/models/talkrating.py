@@ -0,0 +1,132 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import Counter
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from badge.models import Talk, Vote
+
+RATINGS = range(0, 6)
+
+
+def stars(rating):
+    return 'stars_{}'.format(rating)
+
+
+class TalkRatingManager(models.Manager):
+
+    def record(self, changes, create=True):
+        """
+        Applies a list of ``(talk_id, previous, rating)`` vote changes to the aggregates.
+
+        ``previous`` is the rating a vote replaced (``None`` for a new vote) and ``rating``
+        the new one (``None`` for a removed vote). All talks are updated with a single
+        ``UPDATE`` using ``F()`` expressions, so it is safe against concurrent votes.
+
+        Returns the applied deltas per talk.
+        """
+        deltas = {}
+        for talk_id, previous, rating in changes:
+            delta = deltas.setdefault(talk_id, Counter())
+            if previous is not None:
+                delta['sum'] -= previous
+                delta['count'] -= 1
+                delta[stars(previous)] -= 1
+            if rating is not None:
+                delta['sum'] += rating
+                delta['count'] += 1
+                delta[stars(rating)] += 1
+        deltas = {talk_id: delta for talk_id, delta in deltas.items() if any(delta.values())}
+        if len(deltas) == 0:
+            return deltas
+        if create:
+            existing = set(self.filter(talk_id__in=deltas.keys()).values_list('talk_id', flat=True))
+            missing = deltas.keys() - existing
+            if len(missing) > 0:
+                try:
+                    with transaction.atomic():
+                        self.bulk_create([self.model(talk_id=talk_id) for talk_id in missing])
+                except IntegrityError:
+                    for talk_id in missing:
+                        self.get_or_create(talk_id=talk_id)
+        fields = set(field for delta in deltas.values() for field in delta.keys())
+        self.filter(talk_id__in=deltas.keys()).update(**{
+            field: F(field) + Case(
+                *[
+                    When(talk_id=talk_id, then=Value(delta[field]))
+                    for talk_id, delta in deltas.items()
+                    if delta[field] != 0
+                ],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            for field in fields
+        })
+        return deltas
+
+
+class TalkRating(models.Model):
+    talk = models.OneToOneField(Talk, primary_key=True, related_name='aggregate', on_delete=models.CASCADE)
+    sum = models.PositiveIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+    stars_0 = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    objects = TalkRatingManager()
+
+    def __str__(self):
+        return 'TalkRating ({}, {}, {})'.format(self.talk.__str__(), self.mean, self.count)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count > 0 else 0
+
+    @property
+    def histogram(self):
+        return [getattr(self, stars(rating)) for rating in RATINGS]
+
+
+@receiver(post_save, sender=Talk)
+def create_talk_rating(sender, instance: Talk, created, **kwargs):
+    if created:
+        TalkRating.objects.get_or_create(talk=instance)
+
+
+@receiver(post_delete, sender=Vote)
+def remove_vote(sender, instance: Vote, **kwargs):
+    # The talk might be deleted as well, so only ever touch existing aggregates
+    TalkRating.objects.record([(instance.talk_id, instance.rating, None)], create=False)
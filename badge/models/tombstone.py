@@ -0,0 +1,80 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from contextlib import contextmanager
+from threading import local
+
+from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from badge.models import Badge, Post, Setting, Vote
+
+
+class Tombstone(models.Model):
+    """
+    Marks a deleted row for consumers of the change feed.
+    """
+    model = models.CharField(max_length=32)
+    object_id = models.CharField(max_length=64)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id']),
+        ]
+
+    def __str__(self):
+        return 'Tombstone({}, {}, {})'.format(self.model, self.object_id, self.deleted_at)
+
+
+_archiving = local()
+
+
+@contextmanager
+def archiving():
+    """
+    Rows deleted inside the block were only moved to the archive, they get no tombstone and
+    do not show up as deleted in the change feed.
+    """
+    depth = getattr(_archiving, 'depth', 0)
+    _archiving.depth = depth + 1
+    try:
+        yield
+    finally:
+        _archiving.depth = depth
+
+
+@receiver(post_delete, sender=Badge)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Setting)
+@receiver(post_delete, sender=Vote)
+def bury(sender, instance, **kwargs):
+    if getattr(_archiving, 'depth', 0) > 0:
+        return
+    Tombstone.objects.create(model=sender._meta.model_name, object_id=str(instance.pk))
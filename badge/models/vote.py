@@ -39,6 +39,11 @@ class Vote(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     changed_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['changed_at', 'id']),
+        ]
+
     def __str__(self):
         return 'Rating ({}, {})'.format(self.talk.__str__(), self.rating)
 
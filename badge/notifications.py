@@ -0,0 +1,79 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from contextlib import contextmanager
+from threading import Event, Lock
+
+
+class Notifier:
+    """
+    Lets requests wait for something to happen to a key, e.g. a badge receiving a message.
+
+    Waiters register an ``Event`` for their key which is set and dropped by ``notify``, so
+    every waiter has to listen again after it woke up. This only reaches waiters in the
+    same process, callers are expected to re-check their condition now and then.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._events = {}
+
+    @contextmanager
+    def listen(self, key):
+        with self._lock:
+            event, waiters = self._events.get(key, (None, 0))
+            if event is None:
+                event = Event()
+            self._events[key] = (event, waiters + 1)
+        try:
+            yield event
+        finally:
+            with self._lock:
+                current, waiters = self._events.get(key, (None, 0))
+                if current is event:
+                    if waiters > 1:
+                        self._events[key] = (event, waiters - 1)
+                    else:
+                        del self._events[key]
+
+    def notify(self, key):
+        with self._lock:
+            event, waiters = self._events.pop(key, (None, 0))
+        if event is not None:
+            event.set()
+
+    def notify_all(self):
+        with self._lock:
+            events = self._events
+            self._events = {}
+        for event, waiters in events.values():
+            event.set()
+
+
+notifier = Notifier()
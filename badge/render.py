@@ -0,0 +1,216 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+from django.conf import settings
+
+WIDTH = 296
+HEIGHT = 128
+FRAME_SIZE = WIDTH * HEIGHT // 8  # One bit per pixel
+ROW_SIZE = WIDTH // 8
+
+# Encodings of the rows in a delta upload
+DELTA_RAW = 0
+DELTA_ZLIB = 1
+DELTA_RLE = 2  # Pairs of (count, value) bytes
+
+
+def decode(images):
+    """
+    Stacks the raw images into one (n, FRAME_SIZE) array of inverted, packed frames. Images
+    of the wrong size are repeated or cut to FRAME_SIZE bytes, like the badges display them.
+    """
+    frames = np.empty((len(images), FRAME_SIZE), dtype=np.uint8)
+    for i, data in enumerate(images):
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        frames[i] = data if len(data) == FRAME_SIZE else np.resize(data, FRAME_SIZE)
+    return np.invert(frames, out=frames)
+
+
+def frame_rows(data):
+    """
+    The packed frame ``data`` shows on a badge, as a writable (HEIGHT, ROW_SIZE) array.
+    """
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros((HEIGHT, ROW_SIZE), dtype=np.uint8)
+    return np.resize(data, (HEIGHT, ROW_SIZE))
+
+
+def decompress(encoding, payload):
+    """
+    Decodes the rows of a delta upload, never expanding them beyond a full frame.
+    """
+    if encoding == DELTA_RAW:
+        rows = payload
+    elif encoding == DELTA_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            rows = decompressor.decompress(payload, FRAME_SIZE)
+        except zlib.error:
+            raise ValueError('Invalid zlib data')
+        if not decompressor.eof or decompressor.unconsumed_tail:
+            raise ValueError('Compressed rows are too long')
+    elif encoding == DELTA_RLE:
+        if len(payload) % 2 != 0:
+            raise ValueError('Run-length data must consist of (count, value) pairs')
+        pairs = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 2)
+        if pairs[:, 0].sum(dtype=np.int64) > FRAME_SIZE:
+            raise ValueError('Run-length rows are too long')
+        rows = np.repeat(pairs[:, 1], pairs[:, 0]).tobytes()
+    else:
+        raise ValueError('Unknown encoding {}'.format(encoding))
+    if len(rows) == 0 or len(rows) % ROW_SIZE != 0:
+        raise ValueError('Rows must be multiples of {} bytes'.format(ROW_SIZE))
+    return np.frombuffer(rows, dtype=np.uint8).reshape(-1, ROW_SIZE)
+
+
+def apply_delta(data, delta):
+    """
+    Applies a delta upload to the image ``data`` and returns the new frame. A delta is an
+    encoding byte, the big-endian first row and the encoded rows replacing the ones from there.
+    """
+    if len(delta) < 3:
+        raise ValueError('Delta is too short')
+    start = int.from_bytes(delta[1:3], 'big')
+    rows = decompress(delta[0], delta[3:])
+    if start + len(rows) > HEIGHT:
+        raise ValueError('Rows {} to {} are outside of the frame'.format(start, start + len(rows)))
+    result = frame_rows(data)
+    result[start:start + len(rows)] = rows
+    return result.tobytes()
+
+
+def encode_frame(frame):
+    buffer = BytesIO()
+    Image.frombytes('1', (WIDTH, HEIGHT), frame.tobytes()).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def mosaic(images, columns):
+    """
+    Tiles the raw images row by row into one PNG, ``columns`` frames wide. Frames are whole
+    bytes wide, so the packed frames are tiled without unpacking them.
+    """
+    rows = max(1, -(-len(images) // columns))
+    # Inverted blank frames fill up the last row
+    tiles = np.full((rows * columns, FRAME_SIZE), 0xff, dtype=np.uint8)
+    tiles[:len(images)] = decode(images)
+    sheet = tiles.reshape(rows, columns, HEIGHT, ROW_SIZE).transpose(0, 2, 1, 3)
+    buffer = BytesIO()
+    Image.frombytes('1', (columns * WIDTH, rows * HEIGHT), sheet.tobytes()).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def encode_frames(frames):
+    return [encode_frame(frame) for frame in frames]
+
+
+def encode(data):
+    return encode_frame(decode([data])[0])
+
+
+def image_hash(data):
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def pool():
+    """
+    The pool of RENDER_WORKERS processes shared by all requests, started on first use.
+    Workers are spawned from a fork server, never forked from a process that might be
+    running the post feed or long-polling threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=settings.RENDER_WORKERS, mp_context=context)
+        return _pool
+
+
+def encode_all(images):
+    """
+    Encodes a list of raw images to PNGs, on the worker pool once there is more than one
+    chunk of them.
+    """
+    if len(images) == 0:
+        return []
+    frames = decode(images)
+    size = settings.RENDER_CHUNK_SIZE
+    if settings.RENDER_WORKERS > 1 and len(frames) > size:
+        chunks = pool().map(encode_frames, [frames[i:i + size] for i in range(0, len(frames), size)])
+        return [png for chunk in chunks for png in chunk]
+    return encode_frames(frames)
+
+
+def render_all(images):
+    """
+    Renders raw images to PNGs, in the same order. Identical images are encoded once.
+    """
+    digests = [image_hash(data) if data else None for data in images]
+    missing = {}
+    for digest, data in zip(digests, images):
+        if digest and digest not in missing:
+            missing[digest] = data
+    pngs = dict(zip(missing.keys(), encode_all(list(missing.values()))))
+    return [pngs[digest] if digest else b'' for digest in digests]
+
+
+def render_stored(digests):
+    """
+    Renders stored images by their hashes, in the same order. Each image is encoded once and
+    its PNG kept on the image row, image data is only loaded for the ones without one.
+    """
+    from badge.models import BadgeImage
+
+    pngs = dict(BadgeImage.objects.filter(hash__in=set(digest for digest in digests if digest))
+                .values_list('hash', 'png'))
+    missing = [digest for digest, png in pngs.items() if png is None]
+    if len(missing) > 0:
+        images = list(BadgeImage.objects.filter(hash__in=missing).values_list('hash', 'data'))
+        rendered = dict(zip(
+            [digest for digest, _ in images],
+            encode_all([data for _, data in images]),
+        ))
+        BadgeImage.objects.store_pngs(rendered)
+        pngs.update(rendered)
+    return [bytes(pngs.get(digest) or b'') if digest else b'' for digest in digests]
@@ -0,0 +1,132 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from bisect import bisect_right
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from badge.models import Day, Track, Talk
+
+# Bumped in the shared cache on every agenda change, so other processes drop their index
+CACHE_KEY = 'schedule:generation'
+
+
+class ScheduleIndex:
+    """
+    In-memory view of the agenda answering "what is on now and next" per track.
+
+    Every track keeps its talks ordered by time next to a plain list of their start
+    times, so a lookup is a bisect per track and never touches the database. The index
+    is built lazily and dropped whenever a day, track or talk changes. Other processes
+    notice the change through a generation counter in the cache, and every index is
+    rebuilt after ``SCHEDULE_TIMEOUT`` seconds in case the cache is not shared.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._days = None
+        self._generation = 0
+
+    def invalidate(self):
+        try:
+            cache.incr(CACHE_KEY)
+        except ValueError:
+            cache.add(CACHE_KEY, 1, None)
+        with self._lock:
+            self._generation += 1
+            self._days = None
+
+    def build(self):
+        days = {}
+        tracks = {}
+        for day in Day.objects.all():
+            days[day.date] = (day, [])
+        for track in Track.objects.select_related('day').order_by('day', 'id'):
+            tracks[track.id] = (track, [], [])
+            days[track.day.date][1].append(tracks[track.id])
+        for talk in Talk.objects.order_by('time', 'id'):
+            track = tracks.get(talk.track_id)
+            if track is None:
+                continue
+            track[1].append(talk.time)
+            track[2].append(talk)
+        return days
+
+    @property
+    def days(self):
+        shared = cache.get(CACHE_KEY, 0)
+        entry = self._days
+        if entry is not None and entry[1] == shared and entry[2] > monotonic():
+            return entry[0]
+        generation = self._generation
+        days = self.build()
+        with self._lock:
+            # Don't keep an index that was built while the agenda changed
+            if self._generation == generation:
+                self._days = (days, shared, monotonic() + settings.SCHEDULE_TIMEOUT)
+        return days
+
+    def lookup(self, now):
+        """
+        Returns the day of ``now`` and the current and next talk for each of its tracks,
+        or ``None`` if there is no agenda for that date.
+        """
+        entry = self.days.get(now.date())
+        if entry is None:
+            return None
+        day, tracks = entry
+        time = now.time()
+        result = []
+        for track, times, talks in tracks:
+            i = bisect_right(times, time)
+            result.append((
+                track,
+                talks[i - 1] if i > 0 else None,
+                talks[i] if i < len(talks) else None,
+            ))
+        return day, result
+
+
+schedule = ScheduleIndex()
+
+
+@receiver(post_save, sender=Day)
+@receiver(post_delete, sender=Day)
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Track)
+@receiver(post_save, sender=Talk)
+@receiver(post_delete, sender=Talk)
+def invalidate_schedule(sender, **kwargs):
+    transaction.on_commit(schedule.invalidate)
@@ -27,6 +27,471 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from badge import changes, feed, render, schedule
+from badge.exceptions import ApiException, ThrottleError
+from badge.leaderboard import leaderboard
+from badge.models import ApiKey, AuthCode, Badge, BadgeImage, Broadcast, Day, Inbox, Message, Post, Scope, Talk, \
+    TalkRating, Tombstone, Track
+from badge.throttle import throttle
 
 # Create your tests here.
+
+
+class MessageClaimTest(TransactionTestCase):
+    """
+    Polls of the same badge running in parallel must never hand out a message twice.
+    """
+    threads = 8
+    messages = 200
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Needs a file-backed test database shared by all threads')
+        self.sender = Badge.objects.create(id='sender', mac='000000000000', name='Sender', secret='00')
+        self.receiver = Badge.objects.create(id='receiver', mac='000000000000', name='Receiver', secret='00')
+        for i in range(self.messages):
+            Message.objects.send(self.sender, self.receiver, str(i))
+
+    def test_claim(self):
+        claimed = []
+        errors = []
+
+        def poll():
+            try:
+                while True:
+                    message = Message.objects.claim(self.receiver)
+                    if message is None:
+                        break
+                    claimed.append(message.id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=poll) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(claimed), sorted(Message.objects.values_list('id', flat=True)))
+        self.assertEqual(Message.objects.filter(read=False).count(), 0)
+        self.assertEqual(Inbox.objects.get(badge=self.receiver).unread, 0)
+
+
+@override_settings(POST_STREAM_LAG=0, POST_STREAM_HEARTBEAT=0.1, POST_STREAM_TIMEOUT=1)
+class PostStreamTest(TransactionTestCase):
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Needs a file-backed test database shared with the feed thread')
+        self.sender = Badge.objects.create(id='sender', mac='000000000000', name='Sender', secret='00')
+
+    def test_idle(self):
+        posts = feed.PostFeed()
+        posts.start()
+        # Nobody is subscribed, so the feed does not pick these up
+        for i in range(3):
+            Post.objects.create(sender=self.sender, content=str(i))
+        stream = posts.stream()
+        self.assertTrue(next(stream).startswith('retry:'))
+        new = Post.objects.create(sender=self.sender, content='new')
+        posts.wake()
+        ids = [line[len('id: '):] for event in stream for line in event.split('\n') if line.startswith('id: ')]
+        self.assertEqual(ids, [str(new.id)])
+
+
+class BroadcastTest(TestCase):
+
+    def setUp(self):
+        Broadcast.objects.create(message='old')
+        Broadcast.objects.update(sent=timezone.now() - datetime.timedelta(minutes=1))
+
+    def test_new_badge(self):
+        # Never received a direct message
+        badge = Badge.objects.create(id='badge', mac='000000000000', name='Badge', secret='00')
+        broadcast = Broadcast.objects.create(message='new')
+        self.assertEqual(list(Inbox.objects.pending_broadcasts(badge)), [broadcast])
+        self.assertEqual(Inbox.objects.claim_broadcast(badge), broadcast)
+        self.assertIsNone(Inbox.objects.claim_broadcast(badge))
+
+    def test_missing_inbox(self):
+        Badge.objects.bulk_create([Badge(id=id, mac='000000000000', name=id, secret='00') for id in ['a', 'b']])
+        broadcast = Broadcast.objects.create(message='new')
+        self.assertFalse(Inbox.objects.exists())
+        self.assertEqual(Inbox.objects.claim_broadcast(Badge.objects.get(id='a')), broadcast)
+        # Created by a direct message instead
+        Message.objects.send(Badge.objects.get(id='a'), Badge.objects.get(id='b'), 'hi')
+        self.assertEqual(list(Inbox.objects.pending_broadcasts(Badge.objects.get(id='b'))), [broadcast])
+        self.assertEqual(Inbox.objects.get(badge_id='b').unread, 1)
+
+
+class TalkRatingTest(TestCase):
+
+    def setUp(self):
+        track = Track.objects.create(name='Main', day=Day.objects.create(name='Day 1', date='2019-01-01'))
+        self.talk = Talk.objects.create(title='Talk', speaker='Speaker', agenda_id=1, slug='talk', track=track,
+                                        time='10:00')
+
+    def aggregate(self):
+        return TalkRating.objects.get(talk=self.talk)
+
+    def test_revote(self):
+        TalkRating.objects.record([(self.talk.id, None, 4)])
+        deltas = TalkRating.objects.record([(self.talk.id, 4, 2)])
+        self.assertEqual(dict(deltas[self.talk.id]), dict(sum=-2, count=0, stars_4=-1, stars_2=1))
+        rating = self.aggregate()
+        self.assertEqual((rating.sum, rating.count, rating.mean), (2, 1, 2))
+        self.assertEqual(rating.histogram, [0, 0, 1, 0, 0, 0])
+
+    def test_same_rating(self):
+        TalkRating.objects.record([(self.talk.id, None, 3)])
+        self.assertEqual(TalkRating.objects.record([(self.talk.id, 3, 3)]), {})
+        self.assertEqual(self.aggregate().histogram, [0, 0, 0, 1, 0, 0])
+
+    def test_batch(self):
+        deltas = TalkRating.objects.record([(self.talk.id, None, 5), (self.talk.id, 5, 1), (self.talk.id, None, 3)])
+        self.assertEqual(dict(deltas[self.talk.id]), dict(sum=4, count=2, stars_1=1, stars_3=1, stars_5=0))
+        rating = self.aggregate()
+        self.assertEqual((rating.sum, rating.count), (4, 2))
+        self.assertEqual(rating.histogram, [0, 1, 0, 1, 0, 0])
+
+    def test_remove(self):
+        TalkRating.objects.record([(self.talk.id, None, 5)])
+        TalkRating.objects.record([(self.talk.id, 5, None)])
+        rating = self.aggregate()
+        self.assertEqual((rating.sum, rating.count, rating.mean), (0, 0, 0))
+
+
+class VoteBatchTest(TestCase):
+
+    def setUp(self):
+        badge = Badge.objects.create(id='badge', mac='000000000000', name='Badge', secret='00')
+        self.session = AuthCode.objects.create(id='session', badge=badge, long_lived=True).id
+
+    def send(self, body):
+        return self.client.post('/api/vote/batch', body, content_type='application/json',
+                                HTTP_AUTHORIZATION=self.session)
+
+    def test_out_of_range(self):
+        for body in [
+            '{"votes": [{"talk": 1, "rating": 1e999}]}',
+            '{"votes": [{"talk": %d, "rating": 3}]}' % 2 ** 63,
+            '{"votes": [{"talk": %d, "rating": 3}]}' % -2 ** 63,
+        ]:
+            self.assertEqual(self.send(body).status_code, 400)
+        self.assertEqual(self.send('{"votes": [{"talk": 1, "rating": 3}]}').json()['response']['invalid'], [1])
+
+
+class VoteExportTest(TestCase):
+
+    def setUp(self):
+        key = ApiKey.objects.create()
+        key.scopes.add(Scope.objects.get_or_create(id='votes')[0])
+        self.key = key.key
+
+    def test_invalid_since(self):
+        for since in ['yesterday', '2019-13-45T00:00:00']:
+            response = self.client.get('/api/vote/export', {'since': since}, HTTP_AUTHORIZATION=self.key)
+            self.assertEqual(response.status_code, 400)
+
+
+class LeaderboardTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        track = Track.objects.create(name='Main', day=Day.objects.create(name='Day 1', date='2019-01-01'))
+        self.talk = Talk.objects.create(title='Talk', speaker='Speaker', agenda_id=1, slug='talk', track=track,
+                                        time='10:00')
+        TalkRating.objects.record([(self.talk.id, None, 3)])
+
+    def entry(self):
+        return [(entry['sum'], entry['count']) for entry in leaderboard.top(10)]
+
+    def test_concurrent_updates(self):
+        self.assertEqual(self.entry(), [(3, 1)])
+
+        def vote():
+            for _ in range(50):
+                leaderboard.update({self.talk.id: Counter(sum=4, count=1)})
+
+        threads = [threading.Thread(target=vote) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.entry(), [(3 + 4 * 200, 201)])
+
+    def test_revote(self):
+        self.entry()
+        leaderboard.update(TalkRating.objects.record([(self.talk.id, 3, 1)]))
+        self.assertEqual(self.entry(), [(1, 1)])
+
+
+class DeltaTest(TestCase):
+
+    def test_rows(self):
+        frame = render.apply_delta(b'', bytes([render.DELTA_RAW, 0, 2]) + b'\x0f' * render.ROW_SIZE)
+        self.assertEqual(len(frame), render.FRAME_SIZE)
+        self.assertEqual(frame[2 * render.ROW_SIZE:3 * render.ROW_SIZE], b'\x0f' * render.ROW_SIZE)
+        self.assertEqual(frame.count(0), render.FRAME_SIZE - render.ROW_SIZE)
+
+    def test_full_frame(self):
+        data = bytes(range(256)) * 18 + bytes(128)
+        self.assertEqual(render.apply_delta(b'', bytes([render.DELTA_ZLIB, 0, 0]) + zlib.compress(data)), data)
+        rle = bytes([render.DELTA_RLE, 0, 0]) + bytes([255, 7] * 18 + [146, 7])
+        self.assertEqual(render.apply_delta(data, rle), b'\x07' * render.FRAME_SIZE)
+
+    def test_limits(self):
+        invalid = [
+            b'\x00',
+            bytes([9, 0, 0]) + bytes(render.ROW_SIZE),
+            bytes([render.DELTA_RAW, 0, 0]) + bytes(render.ROW_SIZE - 1),
+            bytes([render.DELTA_RAW, 0, render.HEIGHT - 1]) + bytes(2 * render.ROW_SIZE),
+            bytes([render.DELTA_ZLIB, 0, 0]) + b'junk',
+            bytes([render.DELTA_RLE, 0, 0]) + bytes([1]),
+        ]
+        for delta in invalid:
+            with self.assertRaises(ValueError):
+                render.apply_delta(b'', delta)
+
+    def test_bombs(self):
+        with self.assertRaises(ValueError):
+            render.decompress(render.DELTA_ZLIB, zlib.compress(bytes(render.FRAME_SIZE + render.ROW_SIZE)))
+        with self.assertRaises(ValueError):
+            render.decompress(render.DELTA_RLE, bytes([255, 0] * 19))
+
+
+class RenderStoredTest(TestCase):
+
+    def test_png_kept(self):
+        data = bytes(range(256)) * (render.FRAME_SIZE // 256)
+        digest = BadgeImage.objects.store(data).hash
+        png = render.encode(data)
+        self.assertEqual(render.render_stored([digest, None, 'unknown']), [png, b'', b''])
+        self.assertEqual(bytes(BadgeImage.objects.get(hash=digest).png), png)
+        # Stored PNGs are served as they are, without encoding the data again
+        BadgeImage.objects.filter(hash=digest).update(png=b'kept')
+        self.assertEqual(render.render_stored([digest, digest]), [b'kept', b'kept'])
+        Badge.objects.create(id='badge', mac='000000000000', name='Badge', secret='00', _image_id=digest)
+        self.assertEqual(Badge.objects.get(id='badge').render_png(), b'kept')
+
+
+class PostPageTest(TestCase):
+
+    def setUp(self):
+        self.sender = Badge.objects.create(id='sender', mac='000000000000', name='Sender', secret='00')
+        key = ApiKey.objects.create()
+        key.scopes.add(Scope.objects.get_or_create(id='posts')[0])
+        self.key = key.key
+
+    def post(self, seconds):
+        post = Post.objects.create(sender=self.sender, content=str(seconds))
+        Post.objects.filter(id=post.id).update(created_at=timezone.now() - datetime.timedelta(seconds=seconds))
+        return post.id
+
+    def get(self, **params):
+        response = self.client.get('/api/post/get', params, HTTP_AUTHORIZATION=self.key)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['response']
+        return [post['id'] for post in data['posts']], data
+
+    def test_before(self):
+        ids = [self.post(seconds) for seconds in [50, 40, 30, 20, 10]]
+        page, data = self.get(limit=2)
+        self.assertEqual(page, [ids[4], ids[3]])
+        page, data = self.get(limit=2, before=data['next'])
+        self.assertEqual(page, [ids[2], ids[1]])
+        page, data = self.get(limit=2, before=data['next'])
+        self.assertEqual((page, data['next']), ([ids[0]], None))
+
+    def test_since(self):
+        ids = [self.post(seconds) for seconds in [50, 40, 30, 20]]
+        page, data = self.get(limit=2, since=self.get(limit=4)[1]['next'])
+        # Newest first, but starting right after the cursor
+        self.assertEqual(page, [ids[2], ids[1]])
+        page, data = self.get(limit=2, since=data['latest'])
+        self.assertEqual(page, [ids[3]])
+        page, data = self.get(limit=2, since=data['latest'])
+        self.assertEqual(page, [])
+        self.assertIsNotNone(data['latest'])
+
+    @override_settings(POST_STREAM_LAG=5)
+    def test_since_held_back(self):
+        first = self.post(30)
+        young = self.post(1)
+        page, data = self.get()
+        self.assertEqual(page, [first])
+        # Stamped before the young post, but committed after the wall polled
+        late = self.post(2)
+        Post.objects.update(created_at=F('created_at') - datetime.timedelta(seconds=10))
+        page, data = self.get(since=data['latest'])
+        self.assertEqual(page, [young, late])
+
+
+class ScheduleIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = schedule.ScheduleIndex()
+        self.now = datetime.datetime(2019, 1, 1, 10)
+        track = Track.objects.create(name='Main', day=Day.objects.create(name='Day 1', date=self.now.date()))
+        Talk.objects.create(title='First', speaker='Speaker', agenda_id=1, slug='first', track=track,
+                            time=datetime.time(9))
+
+    def current(self):
+        return self.index.lookup(self.now)[1][0][1].title
+
+    def test_other_process(self):
+        self.assertEqual(self.current(), 'First')
+        Talk.objects.filter(slug='first').update(title='Changed')
+        self.assertEqual(self.current(), 'First')
+        # Another process noticing the change only moves the shared generation
+        schedule.ScheduleIndex().invalidate()
+        self.assertEqual(self.current(), 'Changed')
+
+    @override_settings(SCHEDULE_TIMEOUT=0)
+    def test_timeout(self):
+        self.assertEqual(self.current(), 'First')
+        Talk.objects.filter(slug='first').update(title='Changed')
+        self.assertEqual(self.current(), 'Changed')
+
+
+class ArchiveExportTest(TestCase):
+    ids = ['../../escape', '..', '.hidden', 'dir/name', 'back\\slash', 'plain-id_1.x']
+
+    def setUp(self):
+        for id in self.ids:
+            badge = Badge.objects.create(id=id, mac='000000000000', name=id, secret='00')
+            badge.image = [1] * render.FRAME_SIZE
+            badge.save()
+        key = ApiKey.objects.create()
+        key.scopes.add(Scope.objects.get_or_create(id='export')[0])
+        self.key = key.key
+
+    def export(self, output):
+        response = self.client.get('/api/export/archive', {'format': output}, HTTP_AUTHORIZATION=self.key)
+        self.assertEqual(response.status_code, 200)
+        return io.BytesIO(b''.join(response.streaming_content))
+
+    def check(self, names):
+        self.assertEqual(len(names), len(self.ids))
+        self.assertIn('plain-id_1.x.png', names)
+        for name in names:
+            self.assertNotIn('/', name)
+            self.assertNotIn('\\', name)
+            self.assertNotIn('..', name[:-len('.png')])
+            self.assertFalse(name.startswith('.'))
+        self.assertIn('%{}.png'.format('../../escape'.encode('utf8').hex()), names)
+
+    def test_tar(self):
+        self.check(tarfile.open(fileobj=self.export('tar')).getnames())
+
+    def test_zip(self):
+        self.check(zipfile.ZipFile(self.export('zip')).namelist())
+
+
+class ChangesCursorTest(TestCase):
+
+    @staticmethod
+    def cursor(positions):
+        return base64.urlsafe_b64encode(json.dumps(positions).encode('utf8')).decode('ascii')
+
+    def test_round_trip(self):
+        positions = {
+            'badges': (datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc), 'badge'),
+            'posts': (datetime.datetime(2019, 1, 2, tzinfo=datetime.timezone.utc), 3),
+        }
+        self.assertEqual(changes.decode(changes.encode(positions)), positions)
+
+    def test_invalid(self):
+        timestamp = '2019-01-01T00:00:00+00:00'
+        invalid = [
+            'not a cursor',
+            self.cursor({'posts': [timestamp, 'abc']}),
+            self.cursor({'posts': [timestamp, {'a': 1}]}),
+            self.cursor({'posts': [timestamp, None]}),
+            self.cursor({'posts': [timestamp, True]}),
+            self.cursor({'badges': [timestamp, 1]}),
+            self.cursor({'secrets': [timestamp, 1]}),
+            self.cursor({'posts': ['yesterday', 1]}),
+            self.cursor({'posts': [timestamp]}),
+            self.cursor([timestamp, 1]),
+        ]
+        for cursor in invalid:
+            with self.assertRaises(ApiException):
+                changes.changes(cursor, ['badges', 'posts'], 10)
+
+
+class ThrottleTest(TestCase):
+
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE].clear()
+
+    def test_retry_after_failure(self):
+        with self.assertRaises(ValueError):
+            with throttle('post', 'b1', 'hello'):
+                raise ValueError()
+        with throttle('post', 'b1', 'hello'):
+            pass
+        with self.assertRaises(ThrottleError):
+            with throttle('post', 'b1', 'hello'):
+                pass
+
+    def test_message_type(self):
+        Badge.objects.create(id='b1', mac='000000000000', name='Alice', secret='00')
+        for message in [1, {'a': 1}, ['a', 'b']]:
+            response = self.client.post('/api/message/send', json.dumps({'receiver': 'b1', 'message': message}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class CompactTest(TestCase):
+
+    def setUp(self):
+        badge = Badge.objects.create(id='b1', mac='000000000000', name='Alice', secret='00')
+        self.code = AuthCode.objects.create(id='code', badge=badge)
+        expired = settings.AUTHCODE_LIFETIME + 600
+        AuthCode.objects.filter(id='code').update(last_used=timezone.now() - datetime.timedelta(seconds=expired))
+
+    def compact(self, *args):
+        call_command('compact', 'authcode', *args, stdout=io.StringIO())
+        return AuthCode.objects.filter(id='code').exists()
+
+    def test_authcode_retention(self):
+        self.assertTrue(self.compact('--retention', 'authcode=3600'))
+        self.assertFalse(self.compact('--retention', 'authcode=60'))
+
+    def test_unknown_retention(self):
+        with self.assertRaises(CommandError):
+            self.compact('--retention', 'secrets=60')
+        self.assertTrue(AuthCode.objects.filter(id='code').exists())
+
+    def test_archived_posts(self):
+        post = Post.objects.create(sender=self.code.badge, content='old')
+        with tempfile.TemporaryDirectory() as archive:
+            call_command('compact', 'post', '--retention', 'post=0', '--archive', archive, stdout=io.StringIO())
+        self.assertFalse(Post.objects.filter(id=post.id).exists())
+        self.assertFalse(Tombstone.objects.exists())
+        Post.objects.create(sender=self.code.badge, content='new').delete()
+        self.assertEqual(Tombstone.objects.count(), 1)
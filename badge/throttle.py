@@ -0,0 +1,86 @@
+# The BSD 3-Clause License
+#
+# Copyright (c) 2019 "Malte Heinzelmann" <malte@hnzlmnn.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from badge.exceptions import ThrottleError
+
+
+def check_rate(scope, sender):
+    """
+    Sliding window counter: the count of the previous fixed window is weighted by how much
+    of it still overlaps the sliding window and added to the count of the current one.
+    """
+    limit, window = settings.THROTTLE[scope]
+    cache = caches[settings.THROTTLE_CACHE]
+    now = time.time()
+    index = int(now // window)
+    key = 'throttle:{}:{}:{}'.format(scope, sender, index)
+    previous = cache.get('throttle:{}:{}:{}'.format(scope, sender, index - 1), 0)
+    cache.add(key, 0, window * 2)
+    try:
+        current = cache.incr(key)
+    except ValueError:
+        # Evicted in between
+        cache.set(key, 1, window * 2)
+        current = 1
+    overlap = 1 - (now % window) / window
+    if previous * overlap + current > limit:
+        raise ThrottleError('Too many requests, slow down!')
+
+
+def check_duplicate(scope, sender, content):
+    """
+    Claims the content for the sender and returns the cache key holding the claim.
+    """
+    digest = hashlib.sha256(content.encode('utf8')).hexdigest()
+    key = 'duplicate:{}:{}:{}'.format(scope, sender, digest)
+    if not caches[settings.THROTTLE_CACHE].add(key, True, settings.THROTTLE_DUPLICATE_TIMEOUT):
+        raise ThrottleError('Duplicate content!')
+    return key
+
+
+@contextmanager
+def throttle(scope, sender, content):
+    """
+    Wraps storing the content. The content only counts as sent once the block finished,
+    so a retry after a failed insert is not rejected as duplicate.
+    """
+    check_rate(scope, sender)
+    key = check_duplicate(scope, sender, content)
+    try:
+        yield
+    except BaseException:
+        caches[settings.THROTTLE_CACHE].delete(key)
+        raise
@@ -38,23 +38,38 @@ urlpatterns = [
     path('auth', views.auth, name='auth'),
     path('name', views.name, name='name'),
     path('image', views.image, name='image'),
+    path('image/raw', views.image_raw, name='image_raw'),
+    path('image/delta', views.image_delta, name='image_delta'),
     path('clear_image', views.clear_image, name='clear_image'),
     # Vote
     path('vote/send', views.vote_send, name='vote_send'),
+    path('vote/batch', views.vote_batch, name='vote_batch'),
     path('vote/get', views.vote_get, name='vote_get'),
+    path('vote/leaderboard', views.vote_leaderboard, name='vote_leaderboard'),
+    path('vote/export', views.vote_export, name='vote_export'),
     # Token
     path('token/submit', views.token_submit, name='token_submit'),
     # Message
     path('message/send', views.message_send, name='message_send'),
     path('message/get', views.message_get, name='message_get'),
+    path('message/inbox', views.message_inbox, name='message_inbox'),
+    path('message/ack', views.message_ack, name='message_ack'),
+    path('message/count', views.message_count, name='message_count'),
     # Post
     path('post/send', views.post_send, name='post_send'),
     path('post/get', views.post_get, name='post_get'),
+    path('post/search', views.post_search, name='post_search'),
+    path('post/stream', views.post_stream, name='post_stream'),
+    # Schedule
+    path('schedule/now', views.schedule_now, name='schedule_now'),
     # Settings
     path('settings/update', views.settings_update, name='settings_update'),
     path('settings/get', views.settings_get, name='settings_get'),
     path('settings/set', views.settings_set, name='settings_set'),
     # Export
     path('export/all', views.export_all, name='export_all'),
+    path('export/archive', views.export_archive, name='export_archive'),
+    path('export/changes', views.export_changes, name='export_changes'),
+    path('export/mosaic', views.export_mosaic, name='export_mosaic'),
     path('export/single', views.export_single, name='export_single'),
 ]
\ No newline at end of file
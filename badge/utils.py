@@ -31,11 +31,22 @@ from io import BytesIO
 from os import listdir
 from os.path import abspath, realpath, dirname, join as joinpath
 from builtins import open as bltn_open
+from itertools import chain
+import base64
+import binascii
+import csv
+import json
 import logging
+import re
+import tarfile
+import zipfile
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 
-from badge.exceptions import AuthenticationError
+from badge.exceptions import AuthenticationError, ApiException
 from badge.models import Badge, AuthCode
 
 logger = logging.getLogger(__name__)
@@ -70,6 +81,55 @@ def get_badge(request, raise_exception=True):
     return None
 
 
+def get_api_key(request, scope):
+    # badge.models imports this module before ApiKey is defined
+    from badge.models import ApiKey
+    key = request.META.get('HTTP_AUTHORIZATION', None)
+    if key is None:
+        raise AuthenticationError('No API key specified!')
+    try:
+        api_key = ApiKey.objects.get(key=key)
+    except ApiKey.DoesNotExist:
+        raise AuthenticationError('Invalid API key specified!')
+    if not api_key.scopes.filter(id=scope).exists():
+        raise AuthenticationError('Invalid API key scope!')
+    return api_key
+
+
+def encode_cursor(timestamp, pk):
+    """
+    Opaque cursor pointing behind the row with the given timestamp and primary key.
+    """
+    value = '{}|{}'.format(timestamp.isoformat(), pk)
+    return base64.urlsafe_b64encode(value.encode('utf8')).decode('ascii')
+
+
+def decode_cursor(cursor, pk_type=int):
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8').split('|', 1)
+        timestamp = parse_datetime(timestamp)
+        pk = pk_type(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ApiException('Invalid cursor set!', 400)
+    if timestamp is None:
+        raise ApiException('Invalid cursor set!', 400)
+    return timestamp, pk
+
+
+SAFE_FILENAME = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]*$')
+
+
+def safe_filename(name):
+    """
+    ``name`` if it can be used as a file name in an archive as is. Anything that could
+    leave the extraction directory or be hidden (separators, ``..``, a leading dot) is
+    hex-encoded behind a ``%``, which safe names never contain.
+    """
+    if SAFE_FILENAME.match(name) and '..' not in name:
+        return name
+    return '%' + name.encode('utf8').hex()
+
+
 class SafeTar:
 
     @staticmethod
@@ -148,6 +208,7 @@ class FileStream(object):
     def __init__(self):
         self.buffer = BytesIO()
         self.offset = 0
+        self.drained = 0
 
     def write(self, s):
         self.buffer.write(s)
@@ -156,6 +217,9 @@ class FileStream(object):
     def tell(self):
         return self.offset
 
+    def flush(self):
+        pass
+
     def close(self):
         self.buffer.close()
 
@@ -167,4 +231,96 @@ class FileStream(object):
 
         return s
 
+    def drain(self):
+        # Like pop, but remembers the offset it was emptied at
+        self.drained = self.offset
+        return self.pop()
+
+
+class Echo(object):
+    """
+    File-like object handing back whatever is written to it, used to get single lines
+    out of a ``csv.writer``.
+    """
+
+    def write(self, value):
+        return value
+
+
+def buffered(chunks, size=64 * 1024):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if len(buffer) > 0:
+        yield ''.join(buffer)
+
+
+def stream_tar(entries, size=64 * 1024):
+    """
+    Streams (name, data, modified) entries as an uncompressed tar, never holding more than
+    about ``size`` bytes of it.
+    """
+    buffer = FileStream()
+    archive = tarfile.open(mode='w|', fileobj=buffer)
+    for name, data, modified in entries:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = modified.timestamp()
+        archive.addfile(info, BytesIO(data))
+        if buffer.tell() - buffer.drained >= size:
+            yield buffer.drain()
+    archive.close()
+    yield buffer.drain()
+
+
+def stream_zip(entries, size=64 * 1024):
+    """
+    Streams (name, data, modified) entries as a zip, stored without compression like the
+    PNGs it is used for.
+    """
+    buffer = FileStream()
+    # FileStream cannot seek, so zipfile writes data descriptors after every entry
+    archive = zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED)
+    for name, data, modified in entries:
+        archive.writestr(zipfile.ZipInfo(name, modified.timetuple()[:6]), data)
+        if buffer.tell() - buffer.drained >= size:
+            yield buffer.drain()
+    archive.close()
+    yield buffer.drain()
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
 
+def stream_rows(rows, fields, output='ndjson', filename=None):
+    """
+    Streams an iterable of flat dicts as NDJSON or CSV without materialising it.
+    """
+    if output == 'csv':
+        writer = csv.writer(Echo())
+        lines = (writer.writerow(row) for row in chain(
+            [fields],
+            ([row[field] for field in fields] for row in rows),
+        ))
+        content_type = 'text/csv'
+    else:
+        lines = (json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+        content_type = 'application/x-ndjson'
+    response = StreamingHttpResponse(buffered(lines), content_type=content_type)
+    if filename is not None:
+        response['Content-Disposition'] = 'attachment; filename={}.{}'.format(filename, output)
+    return response
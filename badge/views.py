@@ -31,29 +31,45 @@ import logging
 import tarfile
 import json
 import uuid
+from datetime import timedelta
+from time import monotonic
 from os import path
-import statistics
 import requests
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
+from django.core.cache import caches
+from django.db import OperationalError, transaction
+from django.db.models import Count, Max, Q
 import hashlib
 
 from django.utils import timezone
+from django.utils.cache import parse_etags, quote_etag
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
-from badge import utils
+from badge import changes, utils
 from badge.exceptions import ApiResponse, AuthenticationError, RegistrationError, ApiException
-from badge.models import AuthCode, Badge, Talk, Setting, Vote, Track, ApiKey, Scope, Day, Message
+from badge.models import AuthCode, Badge, Talk, Setting, Vote, Track, Day, Message, TalkRating, Inbox, BadgeImage
 from badge.models.app import App
+from badge.feed import feed
+from badge.leaderboard import leaderboard
 from badge.models.post import Post
+from badge.models.talkrating import RATINGS, stars
+from badge.notifications import notifier
+from badge.render import FRAME_SIZE, HEIGHT, WIDTH, apply_delta, mosaic, render_stored
+from badge.schedule import schedule
+from badge.throttle import throttle
 from badge.utils import FileStream, SafeTar
 
 SCOPE_EXPORT = 'export'
 SCOPE_POSTS = 'posts'
 SCOPE_VOTES = 'votes'
 
+# Largest value of an AutoField primary key on every database
+MAX_ID = 2 ** 31 - 1
+
 logger = logging.getLogger(__name__)
 
 
@@ -163,6 +179,44 @@ def image(request):
     return ApiResponse(status=204)
 
 
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def image_raw(request):
+    badge = utils.get_badge(request)
+    if request.method == 'GET':
+        return HttpResponse(badge.image, content_type='application/octet-stream')
+    if request.content_type != 'application/octet-stream':
+        raise ApiException('Image must be sent as application/octet-stream!', 415)
+    if len(request.body) != FRAME_SIZE:
+        raise ApiException('Image must be exactly {} bytes!'.format(FRAME_SIZE), 400)
+    badge.image = request.body
+    badge.save()
+    return ApiResponse(status=204)
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+def image_delta(request):
+    badge = utils.get_badge(request)
+    if request.content_type != 'application/octet-stream':
+        raise ApiException('Delta must be sent as application/octet-stream!', 415)
+    try:
+        with transaction.atomic():
+            # Locks the row where supported, concurrent deltas are applied one after another.
+            # SQLite ignores the lock and fails the losing transaction instead.
+            badge = Badge.objects.select_for_update().get(id=badge.id)
+            try:
+                badge.image = apply_delta(badge.image, request.body)
+            except ValueError as ve:
+                raise ApiException('Invalid delta sent: {}!'.format(ve), 400)
+            badge.save()
+    except OperationalError as oe:
+        if 'database is locked' not in str(oe):
+            raise
+        raise ApiException('Image is being changed, retry!', 409)
+    return ApiResponse(status=204)
+
+
 @csrf_exempt
 @require_http_methods(['GET', 'POST'])
 def clear_image(request):
@@ -209,6 +263,38 @@ def settings_update(request):
     ))
 
 
+def schedule_talk(talk):
+    if talk is None:
+        return None
+    return dict(
+        id=talk.id,
+        title=talk.title,
+        speaker=talk.speaker,
+        time=talk.time,
+    )
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def schedule_now(request):
+    utils.get_badge(request)
+    lookup = schedule.lookup(timezone.localtime())
+    if lookup is None:
+        return ApiResponse(status=204)
+    day, tracks = lookup
+    return ApiResponse(dict(
+        day=day.name,
+        tracks=[
+            dict(
+                name=track.name,
+                current=schedule_talk(current),
+                next=schedule_talk(upcoming),
+            )
+            for track, current, upcoming in tracks
+        ],
+    ))
+
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def settings_set(request):
@@ -283,45 +369,169 @@ def vote_send(request):
     except ValueError:
         raise ApiException('Invalid rating set!', 404)
     badge = utils.get_badge(request)
-    Vote.objects.update_or_create(badge=badge, talk=talk, defaults=dict(
-        rating=rating,
-    ))
+    with transaction.atomic():
+        previous = Vote.objects.select_for_update().filter(badge=badge, talk=talk)\
+            .values_list('rating', flat=True).first()
+        Vote.objects.update_or_create(badge=badge, talk=talk, defaults=dict(
+            rating=rating,
+        ))
+        deltas = TalkRating.objects.record([(talk.id, previous, rating)])
+        transaction.on_commit(lambda: leaderboard.update(deltas))
     return ApiResponse(status=204)
 
 
+@csrf_exempt
+@require_http_methods(['POST'])
+def vote_batch(request):
+    votes = request.JSON.get('votes', None)
+    if votes is None:
+        raise ApiException('No votes set!', 400)
+    if type(votes) is not list or len(votes) > settings.VOTE_BATCH_LIMIT:
+        raise ApiException('Invalid votes set!', 400)
+    ratings = {}
+    for vote in votes:
+        try:
+            talk_id = int(vote['talk'])
+            rating = max(0, min(5, int(vote['rating'])))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ApiException('Invalid vote set!', 400)
+        if abs(talk_id) > MAX_ID:
+            raise ApiException('Invalid vote set!', 400)
+        ratings[talk_id] = rating
+    badge = utils.get_badge(request)
+    talks = set(Talk.objects.filter(id__in=ratings.keys()).values_list('id', flat=True))
+    invalid = [talk_id for talk_id in ratings.keys() if talk_id not in talks]
+    ratings = {talk_id: rating for talk_id, rating in ratings.items() if talk_id in talks}
+    with transaction.atomic():
+        previous = dict(Vote.objects.select_for_update().filter(badge=badge, talk_id__in=ratings.keys())
+                        .values_list('talk_id', 'rating'))
+        Vote.objects.bulk_create([
+            Vote(badge=badge, talk_id=talk_id, rating=rating)
+            for talk_id, rating in ratings.items()
+            if talk_id not in previous
+        ])
+        # One UPDATE per distinct rating instead of one per vote
+        changed = {}
+        for talk_id, rating in ratings.items():
+            if talk_id in previous and previous[talk_id] != rating:
+                changed.setdefault(rating, []).append(talk_id)
+        for rating, talk_ids in changed.items():
+            Vote.objects.filter(badge=badge, talk_id__in=talk_ids).update(rating=rating, changed_at=timezone.now())
+        deltas = TalkRating.objects.record([
+            (talk_id, previous.get(talk_id, None), rating)
+            for talk_id, rating in ratings.items()
+        ])
+        transaction.on_commit(lambda: leaderboard.update(deltas))
+    return ApiResponse(dict(
+        accepted=len(ratings),
+        invalid=invalid,
+    ))
+
+
 @csrf_exempt
 @require_http_methods(['GET'])
 def vote_get(request):
-    key = request.META.get('HTTP_AUTHORIZATION', None)
-    if key is None:
-        raise AuthenticationError('No API key specified!')
-    try:
-        api_key = ApiKey.objects.get(key=key)
-    except ApiKey.DoesNotExist:
-        raise AuthenticationError('Invalid API key specified!')
-    try:
-        api_key.scopes.get(id=SCOPE_VOTES)
-    except Scope.DoesNotExist:
-        raise AuthenticationError('Invalid API key scope!')
+    utils.get_api_key(request, SCOPE_VOTES)
     return ApiResponse(dict(
         votes=[
             dict(
                 talk=dict(
-                    id=talk.agenda_id,
-                    slug=talk.slug,
+                    id=talk['agenda_id'],
+                    slug=talk['slug'],
                 ),
-                **(
-                    lambda votes: dict(
-                        rating=statistics.mean(votes) if len(votes) > 0 else 0,
-                        ratings=len(votes),
-                    )
-                )([vote.rating for vote in Vote.objects.filter(talk=talk)])
+                rating=talk['aggregate__sum'] / talk['aggregate__count'] if talk['aggregate__count'] else 0,
+                ratings=talk['aggregate__count'] or 0,
             )
-            for talk in Talk.objects.all()
+            for talk in Talk.objects.values('agenda_id', 'slug', 'aggregate__sum', 'aggregate__count')
         ],
     ))
 
 
+@csrf_exempt
+@require_http_methods(['GET'])
+def vote_leaderboard(request):
+    utils.get_api_key(request, SCOPE_VOTES)
+    try:
+        limit = int(request.GET.get('limit', 10))
+        day = request.GET.get('day', None)
+        day = int(day) if day is not None else None
+        track = request.GET.get('track', None)
+        track = int(track) if track is not None else None
+    except ValueError:
+        raise ApiException('Invalid filter set!', 400)
+    return ApiResponse(dict(
+        talks=[
+            dict(
+                talk=dict(
+                    id=entry['agenda_id'],
+                    slug=entry['slug'],
+                    title=entry['title'],
+                    speaker=entry['speaker'],
+                ),
+                rating=entry['sum'] / entry['count'] if entry['count'] > 0 else 0,
+                ratings=entry['count'],
+                score=entry['score'],
+            )
+            for entry in leaderboard.top(max(0, limit), day, track)
+        ],
+    ))
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def vote_export(request):
+    utils.get_api_key(request, SCOPE_VOTES)
+    histograms = request.GET.get('histograms', None) is not None
+    output = request.GET.get('format', 'ndjson')
+    if output not in ['ndjson', 'csv']:
+        raise ApiException('Invalid format set!', 400)
+    since = request.GET.get('since', None)
+    if since is not None:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            # Well formed, but out of range
+            raise ApiException('Invalid since set!', 400)
+        if since is None:
+            raise ApiException('Invalid since set!', 400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    if histograms:
+        fields = ['talk', 'slug', 'title', 'speaker', 'rating', 'ratings'] + [stars(rating) for rating in RATINGS]
+        rows = (
+            dict(
+                talk=rating.talk.agenda_id,
+                slug=rating.talk.slug,
+                title=rating.talk.title,
+                speaker=rating.talk.speaker,
+                rating=rating.mean,
+                ratings=rating.count,
+                **{stars(value): count for value, count in zip(RATINGS, rating.histogram)}
+            )
+            for rating in TalkRating.objects.select_related('talk').order_by('talk_id')
+                .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        )
+        return utils.stream_rows(rows, fields, output, 'histograms')
+    votes = Vote.objects.select_related('talk')\
+        .only('id', 'rating', 'created_at', 'changed_at', 'talk', 'talk__agenda_id', 'talk__slug')\
+        .order_by('id')
+    if since is not None:
+        votes = votes.filter(changed_at__gte=since)
+    fields = ['id', 'talk', 'slug', 'rating', 'created_at', 'changed_at']
+    rows = (
+        dict(
+            id=vote.id,
+            talk=vote.talk.agenda_id,
+            slug=vote.talk.slug,
+            rating=vote.rating,
+            created_at=vote.created_at,
+            changed_at=vote.changed_at,
+        )
+        for vote in votes.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    return utils.stream_rows(rows, fields, output, 'votes')
+
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def message_send(request):
@@ -335,26 +545,39 @@ def message_send(request):
     message = request.JSON.get('message', None)
     if message is None:
         raise ApiException('No message set!', 400)
-    try:
-        message = message[:255]
-    except ValueError:
+    if type(message) is not str:
         raise ApiException('Invalid message set!', 400)
+    message = message[:255]
     sender = utils.get_badge(request)
-    Message.objects.create(sender=sender, receiver=receiver, message=message)
+    with throttle('message', sender.id, '{}:{}'.format(receiver.id, message)):
+        Message.objects.send(sender, receiver, message)
+    transaction.on_commit(lambda: notifier.notify(receiver.id))
     return ApiResponse(status=204)
 
 
-@csrf_exempt
-@require_http_methods(['GET'])
-def message_get(request):
-    badge = utils.get_badge(request)
-    messages = Message.objects.filter(receiver=badge, read=False).order_by('sent')
-    if len(messages) is 0:
-        return ApiResponse(status=204)
-    message = messages[0]
-    message.read = True
-    message.save()
-    return ApiResponse(dict(
+def long_poll(request, badge, fetch):
+    """
+    Calls ``fetch`` until it returns something or the ``wait`` seconds requested by the
+    badge have passed, waking up early when a message for the badge is sent.
+    """
+    try:
+        wait = max(0, min(settings.MESSAGE_WAIT_LIMIT, int(request.GET.get('wait', 0))))
+    except ValueError:
+        raise ApiException('Invalid wait set!', 400)
+    deadline = monotonic() + wait
+    while True:
+        # Listen before looking, so a message sent in between wakes us up right away
+        with notifier.listen(badge.id) as event:
+            result = fetch()
+            remaining = deadline - monotonic()
+            if result or remaining <= 0:
+                return result
+            # Messages sent by other processes are only seen by polling again
+            event.wait(min(remaining, settings.MESSAGE_POLL_INTERVAL))
+
+
+def message_dict(message):
+    return dict(
         sender=dict(
             id=message.sender.id,
             name=message.sender.name,
@@ -365,6 +588,119 @@ def message_get(request):
         ),
         message=message.message,
         sent=message.sent,
+    )
+
+
+def broadcast_dict(broadcast, badge):
+    return dict(
+        sender=dict(
+            id=None,
+            name=broadcast.sender,
+        ),
+        receiver=dict(
+            id=badge.id,
+            name=badge.name,
+        ),
+        message=broadcast.message,
+        sent=broadcast.sent,
+    )
+
+
+def claim_message(badge):
+    # Announcements of the organisers go first
+    broadcast = Inbox.objects.claim_broadcast(badge)
+    if broadcast is not None:
+        return broadcast_dict(broadcast, badge)
+    message = Message.objects.claim(badge)
+    if message is not None:
+        return message_dict(message)
+    return None
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def message_get(request):
+    badge = utils.get_badge(request)
+    message = long_poll(request, badge, lambda: claim_message(badge))
+    if message is None:
+        return ApiResponse(status=204)
+    return ApiResponse(message)
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def message_inbox(request):
+    badge = utils.get_badge(request)
+    try:
+        limit = max(1, min(settings.MESSAGE_INBOX_LIMIT, int(request.GET.get('limit', 10))))
+    except ValueError:
+        raise ApiException('Invalid limit set!', 400)
+    messages = Message.objects.filter(receiver=badge, read=False)\
+        .select_related('sender', 'receiver')\
+        .only('id', 'message', 'sent', 'sender__id', 'sender__name', 'receiver__id', 'receiver__name')\
+        .order_by('sent', 'id')
+
+    def fetch():
+        broadcasts = list(Inbox.objects.pending_broadcasts(badge)[:limit])
+        unread = list(messages[:limit - len(broadcasts)]) if len(broadcasts) < limit else []
+        if len(broadcasts) == 0 and len(unread) == 0:
+            return None
+        return broadcasts, unread
+
+    inbox = long_poll(request, badge, fetch)
+    if inbox is None:
+        return ApiResponse(status=204)
+    broadcasts, unread = inbox
+    return ApiResponse(dict(
+        broadcasts=[
+            dict(
+                id=broadcast.id,
+                **broadcast_dict(broadcast, badge)
+            )
+            for broadcast in broadcasts
+        ],
+        messages=[
+            dict(
+                id=message.id,
+                **message_dict(message)
+            )
+            for message in unread
+        ],
+    ))
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+def message_ack(request):
+    ids = request.JSON.get('ids', [])
+    broadcast = request.JSON.get('broadcast', None)
+    if type(ids) is not list:
+        raise ApiException('Invalid ids set!', 400)
+    if len(ids) == 0 and broadcast is None:
+        raise ApiException('No ids set!', 400)
+    try:
+        ids = [int(message_id) for message_id in ids]
+        broadcast = int(broadcast) if broadcast is not None else None
+    except (TypeError, ValueError):
+        raise ApiException('Invalid ids set!', 400)
+    if len(ids) > settings.MESSAGE_INBOX_LIMIT:
+        raise ApiException('Invalid ids set!', 400)
+    badge = utils.get_badge(request)
+    acknowledged = Message.objects.acknowledge(badge, ids) if len(ids) > 0 else 0
+    if broadcast is not None:
+        Inbox.objects.acknowledge_broadcast(badge, broadcast)
+    return ApiResponse(dict(
+        acknowledged=acknowledged,
+    ))
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def message_count(request):
+    badge = utils.get_badge(request)
+    unread = Inbox.objects.filter(badge=badge).values_list('unread', flat=True).first()
+    return ApiResponse(dict(
+        unread=max(0, unread or 0) + Inbox.objects.pending_broadcasts(badge).count(),
     ))
 
 
@@ -374,100 +710,284 @@ def post_send(request):
     content = request.JSON.get('content', None)
     if content is None:
         raise ApiException('No message set!', 400)
-    try:
-        content = content[:255]
-    except ValueError:
+    if type(content) is not str:
         raise ApiException('Invalid message set!', 400)
+    content = content[:255]
     sender = utils.get_badge(request)
-    Post.objects.create(sender=sender, content=content)
+    with throttle('post', sender.id, content):
+        Post.objects.create(sender=sender, content=content)
     return ApiResponse(status=204)
 
 
 @csrf_exempt
 @require_http_methods(['GET'])
 def post_get(request):
-    key = request.META.get('HTTP_AUTHORIZATION', None)
     try:
-        limit = int(request.GET.get('limit', None))
+        limit = max(1, min(settings.POST_PAGE_LIMIT, int(request.GET.get('limit', 10))))
     except ValueError:
         limit = 10
-    if key is None:
-        raise AuthenticationError('No API key specified!')
-    try:
-        api_key = ApiKey.objects.get(key=key)
-    except ApiKey.DoesNotExist:
-        raise AuthenticationError('Invalid API key specified!')
-    try:
-        api_key.scopes.get(id=SCOPE_POSTS)
-    except Scope.DoesNotExist:
-        raise AuthenticationError('Invalid API key scope!')
+    before = request.GET.get('before', None)
+    since = request.GET.get('since', None)
+    utils.get_api_key(request, SCOPE_POSTS)
+    posts = Post.objects.select_related('sender')\
+        .only('id', 'content', 'created_at', 'sender__id', 'sender__name')
+    if before is None or since is not None:
+        # Walls move on with the latest cursor, so like post/stream the newest posts are held
+        # back until any post stamped before them has committed
+        posts = posts.filter(created_at__lte=timezone.now() - timedelta(seconds=settings.POST_STREAM_LAG))
+    if since is not None:
+        # Oldest new posts first, so a wall catching up never skips any
+        created_at, pk = utils.decode_cursor(since)
+        posts = posts.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        posts = list(reversed(posts.order_by('created_at', 'id')[:limit]))
+    else:
+        if before is not None:
+            created_at, pk = utils.decode_cursor(before)
+            posts = posts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        posts = list(posts.order_by('-created_at', '-id')[:limit])
     return ApiResponse(dict(
         posts=[
             dict(
+                id=post.id,
                 sender=dict(
                     id=post.sender.id,
                     name=post.sender.name,
                 ),
                 content=post.content,
+                created_at=post.created_at,
             )
-            for post in Post.objects.all().order_by('-created_at')[:limit]
+            for post in posts
         ],
+        latest=utils.encode_cursor(posts[0].created_at, posts[0].id) if len(posts) > 0 else since,
+        next=utils.encode_cursor(posts[-1].created_at, posts[-1].id) if len(posts) == limit else None,
     ))
 
+
 @csrf_exempt
 @require_http_methods(['GET'])
-def export_all(request):
-    key = request.META.get('HTTP_AUTHORIZATION', None)
-    images = request.GET.get('images', None) is not None
-    if key is None:
-        raise AuthenticationError('No API key specified!')
+def post_search(request):
     try:
-        api_key = ApiKey.objects.get(key=key)
-    except ApiKey.DoesNotExist:
-        raise AuthenticationError('Invalid API key specified!')
-    try:
-        api_key.scopes.get(id=SCOPE_EXPORT)
-    except Scope.DoesNotExist:
-        raise AuthenticationError('Invalid API key scope!')
+        limit = max(1, min(settings.POST_PAGE_LIMIT, int(request.GET.get('limit', 10))))
+    except ValueError:
+        limit = 10
+    query = request.GET.get('q', '').strip()
+    if len(query) == 0:
+        raise ApiException('No search query set!', 400)
+    utils.get_api_key(request, SCOPE_POSTS)
+    posts = Post.objects.search(query).select_related('sender')\
+        .only('id', 'content', 'created_at', 'sender__id', 'sender__name')\
+        .order_by('-created_at', '-id')[:limit]
     return ApiResponse(dict(
-        badges=[
+        posts=[
             dict(
+                id=post.id,
+                sender=dict(
+                    id=post.sender.id,
+                    name=post.sender.name,
+                ),
+                content=post.content,
+                created_at=post.created_at,
+            )
+            for post in posts
+        ],
+    ))
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def post_stream(request):
+    utils.get_api_key(request, SCOPE_POSTS)
+    after = request.META.get('HTTP_LAST_EVENT_ID', None)
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise ApiException('Invalid Last-Event-ID set!', 400)
+    response = StreamingHttpResponse(feed.stream(after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def export_rows(badges, images):
+    # Images are rendered a chunk of badges at a time, so memory does not grow with the fleet
+    for chunk in utils.chunked(badges.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE), settings.EXPORT_CHUNK_SIZE):
+        pngs = render_stored([badge.image_hash for badge in chunk]) if images else [None] * len(chunk)
+        for badge, png in zip(chunk, pngs):
+            yield dict(
                 id=badge.id,
                 name=badge.name,
-                image=badge.render().decode('ascii') if images else None,
+                image=base64.b64encode(png).decode('ascii') if images else None,
             )
-            for badge in Badge.objects.all()
-        ],
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def export_all(request):
+    images = request.GET.get('images', None) is not None
+    output = request.GET.get('format', None)
+    if output not in [None, 'ndjson']:
+        raise ApiException('Invalid format set!', 400)
+    utils.get_api_key(request, SCOPE_EXPORT)
+    badges = Badge.objects.only(*(['id', 'name', '_image'] if images else ['id', 'name'])).order_by('id')
+    if output == 'ndjson':
+        return utils.stream_rows(export_rows(badges, images), ['id', 'name', 'image'])
+    return ApiResponse(dict(
+        badges=list(export_rows(badges, images)),
     ))
 
 
 @csrf_exempt
 @require_http_methods(['GET'])
-def export_single(request):
-    key = request.META.get('HTTP_AUTHORIZATION', None)
-    id = request.GET.get('id', None)
-    if key is None:
-        raise AuthenticationError('No API key specified!')
+def export_changes(request):
+    try:
+        limit = max(1, min(settings.CHANGES_PAGE_LIMIT, int(request.GET.get('limit', 100))))
+    except ValueError:
+        limit = 100
+    include = [feed for feed in request.GET.get('include', '').split(',') if feed]
+    if any(feed not in changes.OPTIONAL for feed in include):
+        raise ApiException('Invalid include set, allowed are {}!'.format(', '.join(changes.OPTIONAL)), 400)
+    utils.get_api_key(request, SCOPE_EXPORT)
+    return ApiResponse(changes.changes(request.GET.get('cursor', None), ['badges'] + include, limit))
+
+
+def archive_entries(badges):
+    for chunk in utils.chunked(badges.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE), settings.EXPORT_CHUNK_SIZE):
+        for badge, png in zip(chunk, render_stored([badge.image_hash for badge in chunk])):
+            yield '{}.png'.format(utils.safe_filename(badge.id)), png, badge.changed_at
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def export_archive(request):
+    output = request.GET.get('format', 'tar')
+    if output not in ['tar', 'zip']:
+        raise ApiException('Invalid format set!', 400)
+    utils.get_api_key(request, SCOPE_EXPORT)
+    badges = Badge.objects.filter(_image__isnull=False).only('id', '_image', 'changed_at').order_by('id')
+    if output == 'zip':
+        response = StreamingHttpResponse(utils.stream_zip(archive_entries(badges)), content_type='application/zip')
+    else:
+        response = StreamingHttpResponse(utils.stream_tar(archive_entries(badges)), content_type='application/x-tar')
+    response['Content-Disposition'] = 'attachment; filename=badges.{}'.format(output)
+    return response
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def export_mosaic(request):
+    ids = request.GET.get('ids', None)
     try:
-        api_key = ApiKey.objects.get(key=key)
-    except ApiKey.DoesNotExist:
-        raise AuthenticationError('Invalid API key specified!')
+        columns = max(1, min(settings.MOSAIC_COLUMNS_LIMIT, int(request.GET.get('columns', 10))))
+    except ValueError:
+        columns = 10
     try:
-        api_key.scopes.get(id=SCOPE_EXPORT)
-    except Scope.DoesNotExist:
-        raise AuthenticationError('Invalid API key scope!')
-    if id is None:
+        offset = max(0, int(request.GET.get('offset', 0)))
+        limit = max(1, min(settings.MOSAIC_LIMIT, int(request.GET.get('limit', settings.MOSAIC_LIMIT))))
+    except ValueError:
+        raise ApiException('Invalid offset or limit set!', status=400)
+    utils.get_api_key(request, SCOPE_EXPORT)
+    badges = Badge.objects.all()
+    if ids is not None:
+        ids = [id for id in ids.split(',') if id]
+        if len(ids) == 0:
+            raise ApiException('Missing ids!', status=400)
+        badges = badges.filter(id__in=ids)
+    # Any change to one of the badges moves changed_at, adding or removing one changes the
+    # count, either of which can shift the badges on every page
+    state = badges.aggregate(changed_at=Max('changed_at'), count=Count('id'))
+    key = 'mosaic:{}'.format(hashlib.sha256('{}|{}|{}|{}|{}|{}'.format(
+        ','.join(sorted(ids)) if ids is not None else '*', columns, offset, limit,
+        state['changed_at'], state['count'],
+    ).encode('utf8')).hexdigest())
+    cache = caches[settings.MOSAIC_CACHE]
+    result = cache.get(key)
+    if result is None:
+        badges = list(badges.only('id', 'name', '_image').order_by('id')[offset:offset + limit])
+        images = dict(BadgeImage.objects.filter(
+            hash__in=set(badge.image_hash for badge in badges if badge.image_hash),
+        ).values_list('hash', 'data'))
+        result = dict(
+            image=base64.b64encode(mosaic(
+                [images.get(badge.image_hash, b'') for badge in badges], columns,
+            )).decode('ascii'),
+            width=WIDTH,
+            height=HEIGHT,
+            columns=columns,
+            offset=offset,
+            total=state['count'],
+            next=offset + limit if offset + limit < state['count'] else None,
+            tiles=[
+                dict(
+                    id=badge.id,
+                    name=badge.name,
+                    x=(index % columns) * WIDTH,
+                    y=(index // columns) * HEIGHT,
+                )
+                for index, badge in enumerate(badges)
+            ],
+        )
+        cache.set(key, result, settings.MOSAIC_TIMEOUT)
+    return ApiResponse(result)
+
+
+def badge_etag(badge):
+    # changed_at moves with every save, the image hash covers images edited in place
+    return hashlib.sha256('{}|{}|{}'.format(badge.id, badge.changed_at.isoformat(), badge.image_hash)
+                          .encode('utf8')).hexdigest()[:32]
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+def export_single(request):
+    ids = [id for value in request.GET.getlist('id') for id in value.split(',') if id]
+    utils.get_api_key(request, SCOPE_EXPORT)
+    if len(ids) == 0:
         raise ApiException('Missing id!', status=400)
-    try:
-        badge = Badge.objects.get(id=id)
-    except Badge.DoesNotExist:
+    if len(ids) > settings.EXPORT_SINGLE_LIMIT:
+        raise ApiException('Too many ids, at most {} allowed!'.format(settings.EXPORT_SINGLE_LIMIT), status=400)
+    badges = {
+        badge.id: badge
+        for badge in Badge.objects.filter(id__in=ids).only('id', 'name', 'mac', '_image', 'changed_at')
+    }
+    many = len(request.GET.getlist('id')) > 1 or ',' in request.GET['id']
+    if not many and len(badges) == 0:
         raise ApiException('Invalid id!', status=400)
-    return ApiResponse(dict(
-        id=badge.id,
-        name=badge.name,
-        mac=badge.mac,
-        image=badge.render().decode('ascii'),
-    ))
+    ids = list(dict.fromkeys(ids))
+    etags = {id: badge_etag(badge) for id, badge in badges.items()}
+    etag = quote_etag(etags[ids[0]] if not many else hashlib.sha256(
+        '|'.join('{}:{}'.format(id, etags.get(id, '')) for id in ids).encode('utf8')
+    ).hexdigest()[:32])
+    # Answered before anything is rendered or encoded, weak tags compare like strong ones
+    if_none_match = [
+        tag[2:] if tag.startswith('W/') else tag
+        for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    ]
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+    found = [badges[id] for id in ids if id in badges]
+    pngs = render_stored([badge.image_hash for badge in found])
+    items = [
+        dict(
+            id=badge.id,
+            name=badge.name,
+            mac=badge.mac,
+            image=base64.b64encode(png).decode('ascii'),
+            etag=quote_etag(etags[badge.id]),
+        )
+        for badge, png in zip(found, pngs)
+    ]
+    if many:
+        response = ApiResponse(dict(
+            badges=items,
+            missing=[id for id in ids if id not in badges],
+        ))
+    else:
+        response = ApiResponse(items[0])
+    response['ETag'] = etag
+    return response
 
 
 
@@ -119,6 +119,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file, not the default in-memory database, so tests can use several connections
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test.sqlite3'),
+        },
     },
     # 'default': {
     #     'ENGINE': 'django.db.backends.mysql',
@@ -131,6 +135,23 @@ DATABASES = {
 }
 
 
+CACHES = {
+    # SETUP: Use a shared cache like memcached when running more than one process
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered mosaic pages, shared between processes
+    'mosaics': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache/mosaics'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -251,9 +272,58 @@ STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
 
+ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+
 
 AUTHCODE_LIFETIME = 30
 AUTHCODE_LENGTH = 6 # Must be an even number
 AUTHCODE_LIMIT = 10
 SESSION_LIFETIME = 3600
+VOTE_BATCH_LIMIT = 100
+SCHEDULE_TIMEOUT = 60  # Seconds a process keeps its agenda index
+EXPORT_CHUNK_SIZE = 2000
+# Long-polling message/get holds a worker thread, so the WSGI server needs enough of them
+MESSAGE_WAIT_LIMIT = 30
+MESSAGE_POLL_INTERVAL = 5
+MESSAGE_INBOX_LIMIT = 50
+POST_PAGE_LIMIT = 100
+# Every post/stream holds a worker thread for up to POST_STREAM_TIMEOUT seconds
+POST_STREAM_INTERVAL = 2
+POST_STREAM_TIMEOUT = 300
+POST_STREAM_HEARTBEAT = 15
+POST_STREAM_RETRY = 1000  # Milliseconds
+POST_STREAM_BUFFER = 200
+# Seconds a post is held back from post/stream and post/get, so posts committing out of
+# order are not skipped.
+# SETUP: SQLite commits one transaction at a time, 0 is safe there
+POST_STREAM_LAG = 1
+# Seconds rows are kept before manage.py compact archives them
+COMPACT_RETENTION = {
+    'message': 3600,
+    'post': 24 * 3600,
+    # On top of AUTHCODE_LIFETIME and SESSION_LIFETIME
+    'authcode': 0,
+    'image': 3600,
+    'tombstone': 30 * 24 * 3600,
+}
+COMPACT_BATCH_SIZE = 500
+# Scope: (requests, seconds) allowed per sender
+THROTTLE = {
+    'message': (10, 60),
+    'post': (5, 60),
+}
+THROTTLE_CACHE = 'default'
+THROTTLE_DUPLICATE_TIMEOUT = 300
+# Full exports encode PNGs on a shared process pool once there is more than one chunk to render
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+RENDER_CHUNK_SIZE = 250
+EXPORT_SINGLE_LIMIT = 100
+CHANGES_PAGE_LIMIT = 1000
+CHANGES_WINDOW = 5  # Seconds the change feed stays behind, to see rows of late commits
+MOSAIC_LIMIT = 500  # Badges per mosaic page
+MOSAIC_COLUMNS_LIMIT = 20
+MOSAIC_CACHE = 'mosaics'
+MOSAIC_TIMEOUT = 3600
+LEADERBOARD_TIMEOUT = 30
+LEADERBOARD_WEIGHT = 5  # Number of average votes every talk starts with
 BADGE_KEY = '' # SETUP: Set this to something secure